@@ -0,0 +1,58 @@
+"""pkgs shaped like the ones from khl server, shared by the benchmarks
+
+the pkgs are generated with a fixed seed, pass ``--frames`` to the benchmarks to use recorded ones instead:
+a file with a json pkg per line, e.g. collected from the ``upcoming raw`` debug log
+"""
+import argparse
+import json
+import random
+from typing import Dict, List
+
+_AUTHOR = {'id': '12345', 'username': 'someone', 'identify_num': '1234', 'online': True,
+           'avatar': 'https://img.kookapp.cn/avatars/a.png', 'vip_avatar': '', 'bot': False, 'roles': [1, 2]}
+
+
+def _text_event(rnd: random.Random, sn: int) -> Dict:
+    return {'s': 0, 'sn': sn, 'd': {
+        'channel_type': 'GROUP', 'type': 9, 'target_id': str(rnd.randrange(10 ** 15)), 'author_id': '12345',
+        'content': 'hello world ' * rnd.randint(1, 40), 'msg_id': f'abcd-efgh-{sn}',
+        'msg_timestamp': 1600000000000 + sn, 'nonce': '',
+        'extra': {'type': 9, 'guild_id': '123', 'channel_name': 'chan', 'mention': [], 'mention_all': False,
+                  'mention_roles': [], 'mention_here': False, 'author': _AUTHOR}}}
+
+
+def _card_event(rnd: random.Random, sn: int) -> Dict:
+    card = {'type': 'card', 'theme': 'primary', 'size': 'lg',
+            'modules': [{'type': 'section', 'text': {'type': 'kmarkdown', 'content': 'line ' * rnd.randint(10, 200)}}
+                        for _ in range(rnd.randint(1, 30))]}
+    pkg = _text_event(rnd, sn)
+    pkg['d'].update(type=10, content=json.dumps([card]))
+    pkg['d']['extra']['type'] = 10
+    return pkg
+
+
+def events(n: int = 2000, *, card_ratio: float = 0.1, seed: int = 1) -> List[Dict]:
+    """group msg events, mostly KMD with a few large card msgs"""
+    rnd = random.Random(seed)
+    return [(_card_event if rnd.random() < card_ratio else _text_event)(rnd, sn) for sn in range(1, n + 1)]
+
+
+def load(path: str) -> List[Dict]:
+    """recorded pkgs, a json pkg per line"""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def parse_args(description: str) -> argparse.Namespace:
+    """common args of the benchmarks"""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--frames', help='file of recorded pkgs, a json pkg per line')
+    parser.add_argument('-n', type=int, default=2000, help='count of generated pkgs, ignored with --frames')
+    parser.add_argument('--card-ratio', type=float, default=0.1, help='ratio of large card msgs in generated pkgs')
+    parser.add_argument('--repeat', type=int, default=7, help='best of how many runs')
+    return parser.parse_args()
+
+
+def corpus(args: argparse.Namespace) -> List[Dict]:
+    """pkgs selected by args"""
+    return load(args.frames) if args.frames else events(args.n, card_ratio=args.card_ratio)
@@ -0,0 +1,69 @@
+"""per-pkg cost of decrypting webhook pkgs, one by one and in batch
+
+the baseline is ``Cert.decrypt`` before the reusable cipher: ``AES.new()`` and ``Padding.unpad()`` per pkg
+"""
+import base64
+import json
+import os
+import random
+import sys
+import timeit
+
+from Cryptodome.Cipher import AES
+from Cryptodome.Util import Padding
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable = wrong-import-position
+import _corpus  # noqa: E402
+from khl import Cert  # noqa: E402
+
+KEY = 'abcdefghijkl'
+
+
+def encrypt(pkg: dict, rnd: random.Random) -> bytes:
+    """encrypt a pkg into a webhook body, the same way as khl server"""
+    iv = ''.join(rnd.choice('0123456789abcdef') for _ in range(16)).encode()
+    cipher = AES.new(KEY.encode().ljust(32, b'\x00'), AES.MODE_CBC, iv=iv)
+    data = cipher.encrypt(Padding.pad(json.dumps(pkg).encode(), 16))
+    body = {'encrypt': base64.b64encode(iv + base64.b64encode(data)).decode()}
+    return json.dumps(body, separators=(',', ':')).encode()
+
+
+def decrypt_before(data: bytes) -> str:
+    """``Cert.decrypt`` before the reusable cipher"""
+    data = base64.b64decode(data)
+    data = AES.new(key=KEY.encode().ljust(32, b'\x00'), mode=AES.MODE_CBC,
+                   iv=data[0:16]).decrypt(base64.b64decode(data[16:]))
+    return Padding.unpad(data, 16).decode('utf-8')
+
+
+def main():
+    """print us/pkg of each case"""
+    args = _corpus.parse_args(__doc__)
+    rnd = random.Random(1)
+    pkgs = _corpus.corpus(args)
+    bodies = [encrypt(pkg, rnd) for pkg in pkgs]
+    payloads = [json.loads(body)['encrypt'] for body in bodies]
+    cert = Cert(token='x', verify_token='x', encrypt_key=KEY)
+
+    assert [decrypt_before(p) for p in payloads] == [cert.decrypt(p) for p in payloads]
+    assert [p.encode() for p in map(decrypt_before, payloads)] == cert.decrypt_batch(payloads)
+    assert [cert.decode_raw(b) for b in bodies] == cert.decode_raw_batch(bodies) == pkgs
+
+    cases = {
+        'decrypt before': lambda: [decrypt_before(p) for p in payloads],
+        'decrypt': lambda: [cert.decrypt(p) for p in payloads],
+        'decrypt_batch': lambda: cert.decrypt_batch(payloads),
+        'decode_raw before': lambda: [json.loads(decrypt_before(json.loads(b)['encrypt'])) for b in bodies],
+        'decode_raw': lambda: [cert.decode_raw(b) for b in bodies],
+        'decode_raw_batch': lambda: cert.decode_raw_batch(bodies),
+    }
+    print(f'{len(bodies)} pkgs, {sum(map(len, bodies)) // len(bodies)}B encrypted on average')
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=1, repeat=args.repeat))
+        print(f'{name:>18}: {best / len(bodies) * 1e6:6.2f} us/pkg')
+
+
+if __name__ == '__main__':
+    main()
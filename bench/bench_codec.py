@@ -0,0 +1,58 @@
+"""per-event cost of ``Cert.decode_raw`` with each json codec installed, and of dumping a card message
+
+the baseline is the stdlib path before the codec: ``json.loads(str(raw, encoding='utf-8'))``
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable = wrong-import-position
+import _corpus  # noqa: E402
+from khl import Cert, use_json_codec  # noqa: E402
+from khl.card import Card, CardMessage, Element, Module  # noqa: E402
+from khl.codec import _FACTORIES, dumps, json_codec  # noqa: E402
+
+
+def _installed():
+    for name, factory in _FACTORIES.items():
+        try:
+            factory()
+        except ImportError:
+            continue
+        yield name
+
+
+def main():
+    """print us/event of each codec"""
+    args = _corpus.parse_args(__doc__)
+    raws = [json.dumps(pkg).encode() for pkg in _corpus.corpus(args)]
+    cert = Cert(token='x')
+    card_msg = CardMessage(*[Card(*[Module.Section(Element.Text(f'line {i}')) for i in range(10)]) for _ in range(3)])
+    default = json_codec()
+
+    def before(raw):
+        raw = json.loads(str(raw, encoding='utf-8'))
+        return json.loads(cert.decrypt(raw['encrypt'])) if ('encrypt' in raw.keys()) else raw
+
+    def per_event(fn) -> float:
+        return min(timeit.repeat(lambda: [fn(r) for r in raws], number=1, repeat=args.repeat)) / len(raws) * 1e6
+
+    def per_card_msg(fn) -> float:
+        return min(timeit.repeat(lambda: fn(card_msg), number=100, repeat=args.repeat)) / 100 * 1e6
+
+    print(f'{len(raws)} events, {sum(map(len, raws)) // len(raws)}B on average, default codec: {default.name}')
+    print(f'{"before":>8}: decode_raw {per_event(before):6.2f} us/event, '
+          f'card msg dumps {per_card_msg(json.dumps):6.1f} us')
+    for name in _installed():
+        use_json_codec(name)
+        assert cert.decode_raw(raws[0]) == before(raws[0])
+        print(f'{name:>8}: decode_raw {per_event(cert.decode_raw):6.2f} us/event, '
+              f'card msg dumps {per_card_msg(dumps):6.1f} us')
+    use_json_codec(default)
+
+
+if __name__ == '__main__':
+    main()
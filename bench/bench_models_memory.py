@@ -0,0 +1,74 @@
+"""bytes per model object, measured by tracemalloc
+
+run against a revision before models got ``__slots__`` to compare, see README.md
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))  # after PYTHONPATH, thus another checkout can be set
+
+# pylint: disable = wrong-import-position
+from khl import User, GuildUser, Role, Guild, PublicTextChannel, PublicMessage  # noqa: E402
+from khl.guild import GuildBoost  # noqa: E402
+
+N = 20000
+
+USER = {'id': '1234567890', 'username': 'someone', 'nickname': 'some', 'identify_num': '1234', 'online': True,
+        'bot': False, 'status': 0, 'avatar': 'https://img.kookapp.cn/avatars/a.png', 'vip_avatar': '',
+        'mobile_verified': True, 'roles': [1, 2, 3]}
+ROLE = {'role_id': 1, 'name': 'admin', 'color': 0, 'position': 1, 'hoist': 0, 'mentionable': 0, 'permissions': 1}
+GUILD = {'id': '1111', 'name': 'guild', 'topic': '', 'user_id': '1234567890', 'icon': '', 'notify_type': 1,
+         'region': 'beijing', 'enable_open': False, 'open_id': '', 'default_channel_id': '2222',
+         'welcome_channel_id': '3333'}
+CHANNEL = {'id': '2222', 'name': 'general', 'user_id': '1234567890', 'guild_id': '1111', 'topic': '',
+           'is_category': 0, 'parent_id': '', 'level': 1, 'slow_mode': 0, 'type': 1, 'permission_overwrites': [],
+           'permission_users': [], 'permission_sync': 1}
+BOOST = {'user_id': '1234567890', 'guild_id': '1111', 'start_time': 1600000000, 'end_time': 1700000000,
+         'user': USER}
+MSG = {'channel_type': 'GROUP', 'type': 9, 'target_id': '2222', 'author_id': '1234567890', 'content': 'hello',
+       'msg_id': 'abcd-efgh', 'msg_timestamp': 1600000000000, 'nonce': '',
+       'extra': {'type': 9, 'guild_id': '1111', 'channel_name': 'general', 'mention': [], 'mention_all': False,
+                 'mention_roles': [], 'mention_here': False, 'author': USER}}
+
+
+def _msg_with_author() -> PublicMessage:
+    msg = PublicMessage(**MSG)
+    _ = msg.author  # built lazily, cached on the msg
+    return msg
+
+
+CASES = [
+    ('User', lambda: User(**USER)),
+    ('GuildUser', lambda: GuildUser(guild_id='1111', **USER)),
+    ('Role', lambda: Role(**ROLE)),
+    ('Guild', lambda: Guild(**GUILD)),
+    ('PublicTextChannel', lambda: PublicTextChannel(**CHANNEL)),
+    ('GuildBoost', lambda: GuildBoost(**BOOST)),
+    ('PublicMessage', lambda: PublicMessage(**MSG)),
+    ('PublicMessage+author', _msg_with_author),
+]
+
+
+def measure(factory) -> float:
+    """bytes allocated per object, the shared input data is excluded"""
+    objs = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(N):
+        objs.append(factory())
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return (total - sys.getsizeof(objs)) / N
+
+
+def main():
+    """print bytes per object of each model"""
+    print(f'python {sys.version.split()[0]}, {N} objects each')
+    for name, factory in CASES:
+        print(f'{name:>22}: {measure(factory):8.1f} bytes/object')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""per-frame cost of the websocket receive path: inflate, parse, debug log
+
+compares ways to inflate a frame, and the receive path before and after the lazy debug log,
+both paths parse with the stdlib json, codecs are compared in ``bench_codec.py``
+"""
+import json
+import logging
+import os
+import sys
+import timeit
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable = wrong-import-position
+import _corpus  # noqa: E402
+from khl import Cert, use_json_codec  # noqa: E402
+
+log = logging.getLogger('khl.receiver')  # debug disabled, as in production
+
+
+def main():
+    """print us/frame of each case"""
+    args = _corpus.parse_args(__doc__)
+    frames = [zlib.compress(json.dumps(pkg).encode()) for pkg in _corpus.corpus(args)]
+    cert = Cert(token='x')
+    template = zlib.decompressobj()
+
+    def inflate_decompress():
+        for f in frames:
+            zlib.decompress(f)
+
+    def inflate_new_obj():
+        for f in frames:
+            zlib.decompressobj().decompress(f)
+
+    def inflate_copied_obj():
+        for f in frames:
+            template.copy().decompress(f)
+
+    def path_before():
+        for f in frames:
+            pkg = json.loads(str(zlib.decompress(f), encoding='utf-8'))
+            log.debug(f'upcoming raw: {pkg}')  # pylint: disable = logging-fstring-interpolation
+
+    def path_after():
+        for f in frames:
+            pkg = cert.decode_raw(zlib.decompress(f))
+            log.debug('upcoming raw: %s', pkg)
+
+    print(f'{len(frames)} frames, {sum(map(len, frames)) // len(frames)}B compressed on average')
+    default = use_json_codec('json')
+    for case in (inflate_decompress, inflate_new_obj, inflate_copied_obj, path_before, path_after):
+        best = min(timeit.repeat(case, number=1, repeat=args.repeat))
+        print(f'{case.__name__:>20}: {best / len(frames) * 1e6:6.2f} us/frame')
+    use_json_codec(default)
+
+
+if __name__ == '__main__':
+    main()
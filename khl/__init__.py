@@ -16,10 +16,15 @@ from ._types import (
     GameTypes,
     FriendTypes
 )
+from .codec import JSONCodec, use_json_codec, json_codec
 from .cert import Cert
 from .receiver import Receiver, WebhookReceiver, WebsocketReceiver
-from .requester import HTTPRequester
-from .ratelimiter import RateLimiter
+from .retry import Retrier, RetryPolicy, RetryOutcomes, RetryRecord, RetryMetrics
+from .requester import HTTPRequester, HTTPConfig
+from .ratelimiter import RateLimiter, PriorityRateLimiter, Priorities
+from .ratelimiter import RateLimitStore, MemoryRateLimitStore, SQLiteRateLimitStore
+from .dispatcher import Dispatcher, WorkerPoolDispatcher, LaneDispatcher, PkgQueue, OverflowPolicies, DispatchMetrics
+from .cache import LRUCache, EntityCache
 from .gateway import Gateway, Requestable
 from .client import Client
 
@@ -32,6 +37,8 @@ from .game import Game
 from .guild import ChannelCategory, Guild, GuildBoost, GuildEmoji
 from .context import Context
 from .message import RawMessage, Message, PublicMessage, PrivateMessage, Event
+from .cache_sync import CacheSync
+from .send_queue import SendQueue
 
 # extensions
 from .bot import Bot
@@ -7,6 +7,9 @@ from typing import Dict, Callable, List, Optional, Union, Coroutine, IO
 
 from .. import AsyncRunnable  # interfaces
 from .. import Cert, HTTPRequester, RateLimiter, WebhookReceiver, WebsocketReceiver, Gateway, Client  # net related
+from .. import PriorityRateLimiter, HTTPConfig  # net tuning
+from .. import Dispatcher  # dispatch related
+from .. import EntityCache, CacheSync  # cache related
 from .. import MessageTypes, EventTypes, SlowModeTypes, SoftwareTypes  # types
 from .. import User, Channel, PublicChannel, Guild, Event, Message  # concepts
 from ..command import CommandManager
@@ -50,7 +53,10 @@ class Bot(AsyncRunnable):
                  compress: bool = True,
                  port=5000,
                  route='/khl-wh',
-                 ratelimiter: Optional[RateLimiter] = RateLimiter(start=80)):
+                 ratelimiter: Optional[RateLimiter] = PriorityRateLimiter(start=80),
+                 dispatcher: Optional[Dispatcher] = None,
+                 cache: Optional[EntityCache] = None,
+                 http_config: Optional[HTTPConfig] = None):
         """
         The most common usage: ``Bot(token='xxxxxx')``
 
@@ -63,11 +69,16 @@ class Bot(AsyncRunnable):
         :param compress: used to tune the receiver
         :param port: used to tune the WebhookReceiver
         :param route: used to tune the WebhookReceiver
+        :param dispatcher: used to tune the client, e.g. ``WorkerPoolDispatcher`` bounds concurrent msg handling
+        :param cache: used to tune the gate, e.g. ``EntityCache()`` caches fetched users/guilds/channels/roles
+        :param http_config: used to tune the out, connection pool and timeouts,
+            to share one session among bots: ``out=HTTPRequester(cert, ratelimiter, session=shared_session)``
         """
         if not token and not cert:
             raise ValueError('require token or cert')
 
-        self._init_client(cert or Cert(token=token), client, gate, out, compress, port, route, ratelimiter)
+        self._init_client(cert or Cert(token=token), client, gate, out, compress, port, route, ratelimiter, dispatcher,
+                          cache, http_config)
         self._register_client_handler()
 
         self.command = CommandManager()
@@ -80,12 +91,13 @@ class Bot(AsyncRunnable):
         self._shutdown_index = []
 
     def _init_client(self, cert: Cert, client: Client, gate: Gateway, out: HTTPRequester, compress: bool, port, route,
-                     ratelimiter):
+                     ratelimiter, dispatcher, cache, http_config):
         """
         construct self.client from args.
 
         you can init client with kinds of filling ways,
-        so there is a priority in the rule: client > gate > out = compress = port = route
+        so there is a priority in the rule:
+        client > gate = dispatcher > out = compress = port = route = cache > http_config
 
         :param cert: used to build requester and receiver
         :param client: the bot relies on
@@ -94,17 +106,20 @@ class Bot(AsyncRunnable):
         :param compress: used to tune the receiver
         :param port: used to tune the WebhookReceiver
         :param route: used to tune the WebhookReceiver
+        :param dispatcher: used to tune the client
+        :param cache: used to tune the gate
+        :param http_config: used to tune the out
         :return:
         """
         if client:
             self.client = client
             return
         if gate:
-            self.client = Client(gate)
+            self.client = Client(gate, dispatcher=dispatcher)
             return
 
         # client and gate not in args, build them
-        _out = out if out else HTTPRequester(cert, ratelimiter)
+        _out = out if out else HTTPRequester(cert, ratelimiter, config=http_config)
         if cert.type == Cert.Types.WEBSOCKET:
             _in = WebsocketReceiver(cert, compress)
         elif cert.type == Cert.Types.WEBHOOK:
@@ -112,7 +127,7 @@ class Bot(AsyncRunnable):
         else:
             raise ValueError(f'cert type: {cert.type} not supported')
 
-        self.client = Client(Gateway(_out, _in))
+        self.client = Client(Gateway(_out, _in, cache=cache), dispatcher=dispatcher)
 
     def _register_client_handler(self):
         # text and kmd -> msg
@@ -120,6 +135,9 @@ class Bot(AsyncRunnable):
         self.client.register(MessageTypes.TEXT, msg_handler)
         self.client.register(MessageTypes.KMD, msg_handler)
 
+        # sys -> cache, no-op if cache not enabled, registered before event handlers thus they see the synced cache
+        self.client.register(MessageTypes.SYS, CacheSync(self.client.gate).handle)
+
         # sys -> event
         self.client.register(MessageTypes.SYS, self._make_event_handler())
 
@@ -483,7 +501,11 @@ class Bot(AsyncRunnable):
         if self._is_running:
             raise RuntimeError('this bot is already running')
         self.task.schedule()
-        await self.client.start()
+        await self.client.gate.requester.start()
+        try:
+            await self.client.start()
+        finally:
+            await self.client.gate.requester.close()
 
     def run(self):
         """run the bot in blocking mode"""
@@ -494,4 +516,5 @@ class Bot(AsyncRunnable):
         except KeyboardInterrupt:
             for func in self._shutdown_index:
                 self.loop.run_until_complete(func(self))
+            self.loop.run_until_complete(self.client.gate.requester.close())
             log.info('see you next time')
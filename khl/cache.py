@@ -0,0 +1,140 @@
+"""cache: keep entities fetched from khl server, to reduce redundant requests"""
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from .interface import LazyLoadable
+
+log = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    a size-limited map, evicts the least recently used entry when full, entries expire ``ttl`` seconds after put
+
+    expired entries are still kept until evicted, ``peek()`` can get them, thus the same key keeps the same object
+    """
+    size: int
+    ttl: float
+    _data: 'OrderedDict[Hashable, Tuple[float, Any]]'
+
+    def __init__(self, size: int = 1000, ttl: float = 600):
+        """
+        :param size: max count of entries
+        :param ttl: seconds, how long an entry is fresh after put, <= 0 means never expire
+        """
+        if size <= 0:
+            raise ValueError('size should be positive')
+        self.size = size
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """get the entry if fresh, else default"""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expire_at, value = entry
+        if 0 < expire_at < time.monotonic():
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """get the entry even if expired, else default"""
+        entry = self._data.get(key)
+        return default if entry is None else entry[1]
+
+    def put(self, key: Hashable, value: Any) -> Any:
+        """put/refresh the entry, returns the value"""
+        expire_at = time.monotonic() + self.ttl if self.ttl > 0 else 0
+        self._data[key] = (expire_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """remove the entry, returns it even if expired, else default"""
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """all entries including the expired, from the least recently used"""
+        return [(k, v) for k, (_, v) in self._data.items()]
+
+    def clear(self):
+        """remove all entries"""
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, None) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class EntityCache:
+    """
+    client-level cache of users, guilds, channels, roles and guild members,
+    which ``Client.fetch_*`` consults before requesting
+
+    it is also an identity map: an id maps to one object, refreshing the entity updates that object in place
+    """
+    users: LRUCache  # user_id -> User
+    guilds: LRUCache  # guild_id -> Guild
+    channels: LRUCache  # channel_id -> PublicChannel
+    roles: LRUCache  # guild_id -> List[Role]
+    members: LRUCache  # (guild_id, user_id) -> GuildUser
+
+    def __init__(self,
+                 *,
+                 user_size: int = 10000,
+                 user_ttl: float = 600,
+                 guild_size: int = 1000,
+                 guild_ttl: float = 600,
+                 channel_size: int = 10000,
+                 channel_ttl: float = 600,
+                 role_size: int = 1000,
+                 role_ttl: float = 600,
+                 member_size: int = 10000,
+                 member_ttl: float = 600):
+        self.users = LRUCache(user_size, user_ttl)
+        self.guilds = LRUCache(guild_size, guild_ttl)
+        self.channels = LRUCache(channel_size, channel_ttl)
+        self.roles = LRUCache(role_size, role_ttl)
+        self.members = LRUCache(member_size, member_ttl)
+
+    @staticmethod
+    def get_loaded(lru: LRUCache, key: Hashable) -> Optional[Any]:
+        """get the entity if it is fresh and loaded"""
+        obj = lru.get(key)
+        if obj is None or (isinstance(obj, LazyLoadable) and not obj.loaded):
+            return None
+        return obj
+
+    @staticmethod
+    def upsert(lru: LRUCache, key: Hashable, data: Dict, factory: Callable[[], Any]) -> Any:
+        """put fetched data into cache
+
+        update the existing object in place if there is one, else construct one with ``factory``
+
+        :return: the cached object
+        """
+        obj = lru.peek(key)
+        if obj is None:
+            obj = factory()
+        else:
+            obj._update_fields(**data)  # pylint: disable = protected-access
+            if isinstance(obj, LazyLoadable):
+                obj.loaded = True
+        return lru.put(key, obj)
+
+    def clear(self):
+        """remove all cached entities"""
+        self.users.clear()
+        self.guilds.clear()
+        self.channels.clear()
+        self.roles.clear()
+        self.members.clear()
@@ -0,0 +1,241 @@
+"""cache_sync: keep the entity cache up to date with SYS events, rather than polling khl server"""
+import functools
+import logging
+from typing import Any, Callable, Dict, FrozenSet, Optional
+
+from ._types import EventTypes
+from .cache import EntityCache
+from .channel import PublicChannel, public_channel_factory
+from .gateway import Gateway
+from .guild import Guild, ChannelCategory
+from .message import Event
+from .permission import ChannelPermission
+from .role import Role
+
+log = logging.getLogger(__name__)
+
+# fields set in constructors with conversion, or identifying the object: never patched from raw event bodies
+_UNPATCHABLE = frozenset(('id', 'type', 'permission', 'gate'))
+
+
+@functools.lru_cache(maxsize=None)
+def _public_slots(cls: type) -> FrozenSet[str]:
+    slots = set()
+    for klass in cls.__mro__:
+        slots.update(s for s in getattr(klass, '__slots__', ()) if not s.startswith('_'))
+    return frozenset(slots - _UNPATCHABLE)
+
+
+def _patch(obj: Any, data: Dict, aliases: Dict[str, str] = None):
+    """set the fields present in data onto obj, fields absent in data are left untouched"""
+    slots = _public_slots(type(obj))
+    for k, v in data.items():
+        k = aliases.get(k, k) if aliases else k
+        if k in slots:
+            setattr(obj, k, v)
+
+
+def _channel_list_fetched(guild: Optional[Guild]) -> bool:
+    """if the guild holds a channel list fetched by ``fetch_channel_list()``, which should be synced as well"""
+    # pylint: disable = protected-access
+    return guild is not None and guild._channels is not None and \
+        all(isinstance(c, PublicChannel) for c in guild._channels)
+
+
+class CacheSync:
+    """
+    applies SYS events onto the gate's ``EntityCache`` incrementally: guilds, channels, channel categories, roles
+    and guild members, so cached entities can live with a long ttl and still up to date
+
+    only touches entities already in cache, does nothing if the gate has no cache
+
+    usage: ``client.register(MessageTypes.SYS, CacheSync(client.gate).handle)``, Bot registers it in default
+    """
+    gate: Gateway
+    _appliers: Dict[EventTypes, Callable[[EntityCache, Event], None]]
+
+    def __init__(self, gate: Gateway):
+        self.gate = gate
+        self._appliers = {
+            EventTypes.UPDATED_GUILD: self._on_updated_guild,
+            EventTypes.DELETED_GUILD: self._on_deleted_guild,
+            EventTypes.SELF_EXITED_GUILD: self._on_deleted_guild,
+            EventTypes.ADDED_ROLE: self._on_added_role,
+            EventTypes.UPDATED_ROLE: self._on_updated_role,
+            EventTypes.DELETED_ROLE: self._on_deleted_role,
+            EventTypes.ADDED_CHANNEL: self._on_added_channel,
+            EventTypes.UPDATED_CHANNEL: self._on_updated_channel,
+            EventTypes.DELETED_CHANNEL: self._on_deleted_channel,
+            EventTypes.EXITED_GUILD: self._on_exited_guild,
+            EventTypes.UPDATED_GUILD_MEMBER: self._on_updated_guild_member,
+            EventTypes.GUILD_MEMBER_ONLINE: self._on_member_online,
+            EventTypes.GUILD_MEMBER_OFFLINE: self._on_member_online,
+            EventTypes.USER_UPDATED: self._on_user_updated,
+        }
+
+    async def handle(self, event: Event):
+        """handler for MessageTypes.SYS"""
+        self.apply(event)
+
+    def apply(self, event: Event) -> bool:
+        """apply the event onto cache
+
+        :return: if the event is a cache-related event and applied"""
+        cache = self.gate.cache
+        if cache is None:
+            return False
+        try:
+            applier = self._appliers.get(event.event_type)
+        except ValueError:  # unknown event type
+            return False
+        if applier is None:
+            return False
+        try:
+            applier(cache, event)
+        except Exception as e:
+            log.exception(f'error raised during syncing cache with event: {event.extra}', exc_info=e)
+            return False
+        return True
+
+    # guild
+
+    @staticmethod
+    def _on_updated_guild(cache: EntityCache, event: Event):
+        guild = cache.guilds.peek(event.body.get('id', event.target_id))
+        if guild is not None:
+            _patch(guild, event.body, {'user_id': 'master_id'})
+
+    @staticmethod
+    def _on_deleted_guild(cache: EntityCache, event: Event):
+        guild_id = event.body.get('guild_id') or event.body.get('id') or event.target_id
+        cache.guilds.pop(guild_id)
+        cache.roles.pop(guild_id)
+        for channel_id, channel in cache.channels.items():
+            if channel.guild_id == guild_id:
+                cache.channels.pop(channel_id)
+        for key, _ in cache.members.items():
+            if key[0] == guild_id:
+                cache.members.pop(key)
+
+    # role, event.target_id is the guild id
+
+    @staticmethod
+    def _on_added_role(cache: EntityCache, event: Event):
+        roles = cache.roles.peek(event.target_id)
+        if roles is not None and all(r.id != event.body['role_id'] for r in roles):
+            roles.append(Role(**event.body))
+
+    @staticmethod
+    def _on_updated_role(cache: EntityCache, event: Event):
+        for role in cache.roles.peek(event.target_id, ()):
+            if role.id == event.body['role_id']:
+                _patch(role, event.body)
+
+    @staticmethod
+    def _on_deleted_role(cache: EntityCache, event: Event):
+        role_id = event.body['role_id']
+        roles = cache.roles.peek(event.target_id)
+        if roles is not None:
+            roles[:] = [r for r in roles if r.id != role_id]  # in place, guild._roles is the same list
+        for (guild_id, _), member in cache.members.items():
+            if guild_id == event.target_id and role_id in (member.roles or ()):
+                member.roles = [r for r in member.roles if r != role_id]
+
+    # channel, event.target_id is the guild id
+
+    def _on_added_channel(self, cache: EntityCache, event: Event):
+        body = event.body
+        guild = cache.guilds.peek(body.get('guild_id', event.target_id))
+        # pylint: disable = protected-access
+        if body.get('is_category'):
+            if _channel_list_fetched(guild) and body['id'] not in guild._channel_categories:
+                guild._channel_categories[body['id']] = ChannelCategory(_gate_=self.gate, _guild_id_=guild.id, **body)
+            return
+        channel = cache.channels.peek(body['id'])
+        if channel is None:
+            channel = cache.channels.put(body['id'], public_channel_factory(_gate_=self.gate, _lazy_loaded_=True,
+                                                                           **body))
+        if _channel_list_fetched(guild):
+            self._attach_channel(guild, channel)
+
+    def _on_updated_channel(self, cache: EntityCache, event: Event):
+        body = event.body
+        guild = cache.guilds.peek(body.get('guild_id', event.target_id))
+        # pylint: disable = protected-access
+        if body.get('is_category'):
+            category = guild._channel_categories.get(body['id']) if _channel_list_fetched(guild) else None
+            if category is not None:
+                _patch(category, body, {'user_id': 'master_id'})
+                self._patch_permission(category, body)
+            return
+        channel = cache.channels.peek(body['id'])
+        if channel is None and _channel_list_fetched(guild):
+            channel = next((c for c in guild._merge_channels() if c.id == body['id']), None)
+        if channel is None:
+            return
+        _patch(channel, body)
+        self._patch_permission(channel, body)
+        if _channel_list_fetched(guild):  # parent_id may be changed
+            self._detach_channel(guild, channel.id)
+            self._attach_channel(guild, channel)
+
+    def _on_deleted_channel(self, cache: EntityCache, event: Event):
+        channel_id = event.body['id']
+        channel = cache.channels.pop(channel_id)
+        guild_id = channel.guild_id if channel is not None else event.target_id
+        guild = cache.guilds.peek(guild_id)
+        if _channel_list_fetched(guild):
+            guild._channel_categories.pop(channel_id, None)  # pylint: disable = protected-access
+            self._detach_channel(guild, channel_id)
+
+    def _patch_permission(self, holder: Any, body: Dict):
+        if 'permission_overwrites' in body or 'permission_users' in body or 'permission_sync' in body:
+            holder.permission = ChannelPermission(_gate_=self.gate, **body)
+
+    @staticmethod
+    def _attach_channel(guild: Guild, channel: PublicChannel):
+        # pylint: disable = protected-access
+        category = guild._channel_categories.get(channel.parent_id)
+        channels = category._channels if category is not None else guild._channels
+        if channel not in channels:
+            channels.append(channel)
+
+    @staticmethod
+    def _detach_channel(guild: Guild, channel_id: str):
+        # pylint: disable = protected-access
+        for channels in [guild._channels] + [c._channels for c in guild._channel_categories.values()]:
+            channels[:] = [c for c in channels if c.id != channel_id]
+
+    # member, event.target_id is the guild id
+
+    @staticmethod
+    def _on_exited_guild(cache: EntityCache, event: Event):
+        cache.members.pop((event.target_id, event.body['user_id']))
+
+    @staticmethod
+    def _on_updated_guild_member(cache: EntityCache, event: Event):
+        member = cache.members.peek((event.target_id, event.body['user_id']))
+        if member is not None:
+            _patch(member, event.body)
+
+    @staticmethod
+    def _on_member_online(cache: EntityCache, event: Event):
+        online = event.event_type == EventTypes.GUILD_MEMBER_ONLINE
+        user_id = event.body['user_id']
+        user = cache.users.peek(user_id)
+        if user is not None:
+            user.online = online
+        for guild_id in event.body.get('guilds', ()):
+            member = cache.members.peek((guild_id, user_id))
+            if member is not None:
+                member.online = online
+
+    @staticmethod
+    def _on_user_updated(cache: EntityCache, event: Event):
+        user_id = event.body['user_id']
+        user = cache.users.peek(user_id)
+        if user is not None:
+            _patch(user, event.body)
+        for (_, member_user_id), member in cache.members.items():
+            if member_user_id == user_id:
+                _patch(member, event.body)
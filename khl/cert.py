@@ -1,10 +1,15 @@
 """authorization/encrypt/decrypt works in khl"""
-import base64
-import json
+import binascii
 from enum import Enum
+from typing import Dict, Iterable, List, Tuple, Union
 
 from Cryptodome.Cipher import AES
-from Cryptodome.Util import Padding
+from Cryptodome.Util.strxor import strxor
+
+from .codec import loads
+
+_ENVELOPE_HEAD = b'{"encrypt":"'
+_ENVELOPE_TAIL = b'"}'
 
 
 class Cert:
@@ -45,21 +50,96 @@ class Cert:
         self.verify_token = verify_token
         self.encrypt_key = encrypt_key
 
-    def decrypt(self, data: bytes) -> str:
+    @property
+    def encrypt_key(self) -> str:
+        """the key to decrypt webhook pkgs, the AES key schedule is prepared once it is set"""
+        return self._encrypt_key
+
+    @encrypt_key.setter
+    def encrypt_key(self, key: str):
+        self._encrypt_key = key
+        # CBC decryption is done with a reusable ECB cipher: AES.new() per pkg would expand the key again and again
+        self._ecb = AES.new(key.encode().ljust(32, b'\x00'), AES.MODE_ECB) if key else None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_ecb']  # cipher objects can not be pickled, e.g. sent to a ProcessPoolExecutor
+        return state
+
+    def __setstate__(self, state):
+        key = state.pop('_encrypt_key')
+        self.__dict__.update(state)
+        self.encrypt_key = key
+
+    @staticmethod
+    def _split(data: Union[bytes, str]) -> Tuple[bytes, bytes]:
+        """split an encrypted payload into iv and ciphertext"""
+        data = binascii.a2b_base64(data)  # iv + base64(ciphertext)
+        cipher = binascii.a2b_base64(memoryview(data)[16:])
+        if not cipher or len(cipher) % 16:
+            raise ValueError('Data must be padded to 16 byte boundary in CBC mode')
+        return data[:16], cipher
+
+    def _decrypt_cbc(self, payloads: List[Tuple[bytes, bytes]]) -> bytes:
+        """CBC decryption of the concatenated ciphertexts in one pass of the ECB cipher, each with its own iv
+
+        plain[i] = D(cipher[i]) ^ cipher[i-1], cipher[-1] is iv"""
+        return strxor(self._ecb.decrypt(b''.join(cipher for _, cipher in payloads)),
+                      b''.join(iv + cipher[:-16] for iv, cipher in payloads))
+
+    def _decrypt_bytes(self, data: Union[bytes, str]) -> bytes:
+        if self._ecb is None:
+            return b''
+        return self._unpad(self._decrypt_cbc([self._split(data)]))
+
+    @staticmethod
+    def _unpad(data: bytes) -> bytes:
+        """strip pkcs7 padding"""
+        pad = data[-1]
+        if not 0 < pad <= 16 or data[-pad:] != bytes((pad,)) * pad:
+            raise ValueError('Padding is incorrect.')
+        return data[:-pad]
+
+    def decrypt(self, data: Union[bytes, str]) -> str:
         """ decrypt data
 
         :param data: encrypted byte array
         :return: decrypted str
         """
-        if not self.encrypt_key:
-            return ''
-        data = base64.b64decode(data)
-        data = AES.new(key=self.encrypt_key.encode().ljust(32, b'\x00'), mode=AES.MODE_CBC,
-                       iv=data[0:16]).decrypt(base64.b64decode(data[16:]))
-        data = Padding.unpad(data, 16)
-        return data.decode('utf-8')
-
-    def decode_raw(self, raw: bytes) -> dict:
-        """decode raw package into plaintext data"""
-        raw = json.loads(str(raw, encoding='utf-8'))
-        return json.loads(self.decrypt(raw['encrypt'])) if ('encrypt' in raw.keys()) else raw
+        return self._decrypt_bytes(data).decode('utf-8')
+
+    def decrypt_batch(self, data: Iterable[Union[bytes, str]]) -> List[bytes]:
+        """decrypt a batch of data in one pass of AES, the key schedule is applied to all ciphertexts at once
+
+        :return: decrypted utf-8 bytes, can be passed to ``json.loads()`` directly
+        """
+        if self._ecb is None:
+            return [b'' for _ in data]
+        payloads = [self._split(d) for d in data]
+        plain = self._decrypt_cbc(payloads)
+        result = []
+        pos = 0
+        for _, cipher in payloads:
+            result.append(self._unpad(plain[pos:pos + len(cipher)]))
+            pos += len(cipher)
+        return result
+
+    def decode_raw(self, raw: Union[bytes, str]) -> Dict:
+        """decode raw package into plaintext data
+
+        bytes are decoded into the pkg in a single pass: the encrypted payload is taken without parsing the envelope
+        if the envelope is in the exact ``{"encrypt":"..."}`` form, and never converted to str"""
+        if isinstance(raw, bytes) and raw.startswith(_ENVELOPE_HEAD) and raw.endswith(_ENVELOPE_TAIL):
+            payload = raw[len(_ENVELOPE_HEAD):-len(_ENVELOPE_TAIL)]
+            if b'"' not in payload and b'\\' not in payload:  # no escaping, nor other fields
+                return loads(self._decrypt_bytes(payload))
+        raw = loads(raw)
+        return loads(self._decrypt_bytes(raw['encrypt'])) if ('encrypt' in raw) else raw
+
+    def decode_raw_batch(self, raws: Iterable[Union[bytes, str]]) -> List[Dict]:
+        """decode a batch of raw packages, encrypted ones are decrypted by ``decrypt_batch()``"""
+        pkgs = [loads(raw) for raw in raws]
+        encrypted = [i for i, pkg in enumerate(pkgs) if 'encrypt' in pkg]
+        for i, plain in zip(encrypted, self.decrypt_batch([pkgs[i]['encrypt'] for i in encrypted])):
+            pkgs[i] = loads(plain)
+        return pkgs
@@ -1,10 +1,10 @@
 """abstraction of khl concept channel: where messages flow in"""
-import json
 from abc import ABC, abstractmethod
 from typing import Union, List, Dict
 
 from . import api
 from ._types import MessageTypes, ChannelTypes, SlowModeTypes, MessageFlagModes
+from .codec import dumps
 from .gateway import Requestable, Gateway
 from .interface import LazyLoadable
 from .permission import ChannelPermission, PermissionHolder
@@ -17,6 +17,7 @@ class Channel(LazyLoadable, Requestable, ABC):
     """
     Interface, represents a channel where messages flowing
     """
+    __slots__ = ()
     type: ChannelTypes
 
     @abstractmethod
@@ -37,6 +38,8 @@ class Channel(LazyLoadable, Requestable, ABC):
 
 class PublicChannel(Channel, PermissionHolder, ABC):
     """the channels in guild, in contrast to PrivateChannel(private chat)"""
+    __slots__ = ('_id', '_loaded', 'gate', 'name', 'user_id', 'guild_id', 'topic', 'is_category', 'parent_id', 'level',
+                 'type', 'permission')
     name: str
     user_id: str
     guild_id: str
@@ -135,6 +138,7 @@ class PublicTextChannel(PublicChannel):
 
     Text chat channels in guild
     """
+    __slots__ = ('slow_mode', )
     slow_mode: int
 
     def _update_fields(self, **kwargs):
@@ -150,7 +154,7 @@ class PublicTextChannel(PublicChannel):
         # if content is card msg, then convert it to plain str
         if isinstance(content, List):
             type = MessageTypes.CARD
-            content = json.dumps(content)
+            content = dumps(content)
         type = type if type is not None else MessageTypes.KMD
 
         # merge params
@@ -169,6 +173,7 @@ class PublicVoiceChannel(PublicChannel):
 
     a placeholder now for future design/adaption
     """
+    __slots__ = ()
 
     async def send(self, content: Union[str, List], **kwargs):
         raise TypeError('now there is no PublicVoiceChannel, *hey dude we have a pkg from future*')
@@ -198,6 +203,8 @@ class PrivateChannel(Channel):
     """Private chat channel
 
     a private channel associates the code and another user(called as target in the following)"""
+    __slots__ = ('code', 'last_read_time', 'latest_msg_time', 'unread_count', 'is_friend', 'is_blocked',
+                 'is_target_blocked', 'target_info', '_loaded', 'gate')
 
     code: str
     last_read_time: int
@@ -4,9 +4,11 @@ import inspect
 import logging
 import time
 from pathlib import Path
-from typing import Dict, List, Callable, Coroutine, Union, IO, Optional
+from typing import Dict, List, Callable, Coroutine, Union, IO, Optional, AsyncIterator
 
 from . import api
+from .cache import EntityCache
+from .dispatcher import Dispatcher
 from .channel import public_channel_factory, PublicChannel, Channel, PublicTextChannel, PublicVoiceChannel
 from .game import Game
 from .gateway import Gateway, Requestable
@@ -32,14 +34,22 @@ class Client(Requestable, AsyncRunnable):
     reminder: Client.loop only used to run handle_event() and registered handlers.
     """
     _handler_map: Dict[MessageTypes, List[TypeHandler]]
+    dispatcher: Optional[Dispatcher]
 
-    def __init__(self, gate: Gateway):
+    def __init__(self, gate: Gateway, *, dispatcher: Dispatcher = None):
+        """
+        :param gate: the client relies on
+        :param dispatcher: decides how pkgs are processed, e.g. ``WorkerPoolDispatcher`` to bound the concurrency,
+            None in default: every handler is scheduled as soon as a pkg arrives
+        """
         self.gate = gate
         self.ignore_self_msg = True
         self._me = None
+        self._me_future = None
 
         self._handler_map = {}
-        self._pkg_queue = asyncio.Queue()
+        self.dispatcher = dispatcher
+        self._pkg_queue = dispatcher.make_queue() if dispatcher is not None else asyncio.Queue()
 
     def register(self, type: MessageTypes, handler: TypeHandler):
         """register handler to handle messages of type"""
@@ -56,6 +66,10 @@ class Client(Requestable, AsyncRunnable):
 
     async def handle_pkg(self):
         """consume `pkg` from `event_queue`"""
+        if self.dispatcher is not None:
+            await self.dispatcher.run(self._pkg_queue, self._process_pkg)
+            return
+
         while True:
             pkg: Dict = await self._pkg_queue.get()
             log.debug(f'upcoming pkg: {pkg}')
@@ -73,11 +87,32 @@ class Client(Requestable, AsyncRunnable):
         check if ignore msgs from self
         pass `msg` to corresponding handlers defined in `_handler_map`
         """
-        msg = self._make_msg(pkg)
-        if self.ignore_self_msg and msg.type != MessageTypes.SYS:
-            if msg.author.id == (await self.fetch_me()).id:
-                return
-        self._dispatch_msg(msg)
+        self._dispatch_msg(await self._pkg_to_msg(pkg))
+
+    async def _process_pkg(self, pkg: Dict):
+        """
+        the same as `_consume_pkg`, but wait until all handlers finished, used by `dispatcher`
+        """
+        msg = await self._pkg_to_msg(pkg)
+        if not msg:
+            return
+        handlers = self._handler_map.get(msg.type, ())
+        await asyncio.gather(*[self._handle_safe(handler)(msg) for handler in handlers])
+
+    async def _pkg_to_msg(self, pkg: Dict):
+        """spawn `msg` according to `pkg`, None if the pkg should be ignored, e.g. sent by self"""
+        if self.ignore_self_msg and pkg.get('type') != MessageTypes.SYS.value:  # SYS pkgs are never from self
+            if self._me is None or not self._me.loaded:  # usually loaded in start()
+                await self.fetch_me()
+            if self._is_self_pkg(pkg):
+                return None
+        return self._make_msg(pkg)
+
+    def _is_self_pkg(self, pkg: Dict) -> bool:
+        """check if the pkg is a msg sent by the client itself, on the raw pkg, thus no msg is constructed for it
+
+        requires ``self._me`` loaded"""
+        return pkg.get('type') != MessageTypes.SYS.value and pkg.get('author_id') == self._me.id
 
     def _make_msg(self, pkg: Dict):
         if pkg.get('type') == MessageTypes.SYS.value:
@@ -126,11 +161,24 @@ class Client(Requestable, AsyncRunnable):
             return (await self.gate.exec_req(api.Asset.create(file=f)))['url']
 
     async def fetch_me(self, force_update: bool = False) -> User:
-        """fetch detail of the ``User`` on the client"""
+        """fetch detail of the ``User`` on the client
+
+        concurrent calls share the same request"""
         if force_update or not self._me or not self._me.is_loaded():
-            self._me = User(_gate_=self.gate, _lazy_loaded_=True, **(await self.gate.exec_req(api.User.me())))
+            if self._me_future is None:
+                self._me_future = asyncio.ensure_future(self._load_me(), loop=self.loop)
+                self._me_future.add_done_callback(self._clear_me_future)
+            # shield: one caller cancelled should not cancel the request shared with others
+            await asyncio.shield(self._me_future)
         return self._me
 
+    async def _load_me(self):
+        self._me = User(_gate_=self.gate, _lazy_loaded_=True, **(await self.gate.exec_req(api.User.me())))
+
+    def _clear_me_future(self, future: asyncio.Future):
+        if self._me_future is future:
+            self._me_future = None
+
     @property
     def me(self) -> User:
         """
@@ -148,16 +196,45 @@ class Client(Requestable, AsyncRunnable):
             return self._me
         raise ValueError('not loaded, please call `await fetch_me()` first')
 
-    async def fetch_user(self, user: Union[User, str]) -> User:
-        """fetch detail of the specific user"""
-        user_id = unpack_id(user)
-        return User(_gate_=self.gate, _lazy_loaded_=True, **(await self.gate.exec_req(api.User.view(user_id))))
+    @property
+    def cache(self) -> Optional[EntityCache]:
+        """the entity cache of the gate, None if not enabled"""
+        return self.gate.cache
 
-    async def fetch_guild(self, guild_id: str) -> Guild:
-        """fetch details of a guild from khl"""
-        guild = Guild(_gate_=self.gate, id=guild_id)
+    async def fetch_user(self, user: Union[User, str], force_update: bool = False) -> User:
+        """fetch detail of the specific user
+
+        :param force_update: skip the cache and fetch from khl, the cached object is updated in place
+        """
+        user_id = unpack_id(user)
+        cache = self.gate.cache
+        if cache is not None and not force_update:
+            cached = cache.get_loaded(cache.users, user_id)
+            if cached is not None:
+                return cached
+        user_data = await self.gate.exec_req(api.User.view(user_id))
+        if cache is None:
+            return User(_gate_=self.gate, _lazy_loaded_=True, **user_data)
+        return cache.upsert(cache.users, user_id, user_data,
+                            lambda: User(_gate_=self.gate, _lazy_loaded_=True, **user_data))
+
+    async def fetch_guild(self, guild_id: str, force_update: bool = False) -> Guild:
+        """fetch details of a guild from khl
+
+        :param force_update: skip the cache and fetch from khl, the cached object is updated in place
+        """
+        cache = self.gate.cache
+        if cache is None:
+            guild = Guild(_gate_=self.gate, id=guild_id)
+            await guild.load()
+            return guild
+        if not force_update:
+            cached = cache.get_loaded(cache.guilds, guild_id)
+            if cached is not None:
+                return cached
+        guild = cache.guilds.peek(guild_id) or Guild(_gate_=self.gate, id=guild_id)
         await guild.load()
-        return guild
+        return cache.guilds.put(guild_id, guild)
 
     async def fetch_guild_list(self, **kwargs) -> List[Guild]:
         """list guilds which the client joined
@@ -166,6 +243,13 @@ class Client(Requestable, AsyncRunnable):
         guilds_data = (await self.gate.exec_paged_req(api.Guild.list(), **kwargs))
         return [Guild(_gate_=self.gate, _lazy_loaded_=True, **i) for i in guilds_data]
 
+    async def iter_guilds(self, **kwargs) -> AsyncIterator[Guild]:
+        """iterate guilds which the client joined, page by page
+
+        paged req, support standard pagination args and ``prefetch``"""
+        async for i in self.gate.iter_paged_req(api.Guild.list(), **kwargs):
+            yield Guild(_gate_=self.gate, _lazy_loaded_=True, **i)
+
     async def leave(self, guild: Union[Guild, str]):
         """leave from ``guild``"""
         guild = Guild(_gate_=self.gate, id=guild) if isinstance(guild, str) else guild
@@ -176,10 +260,21 @@ class Client(Requestable, AsyncRunnable):
         guild = Guild(_gate_=self.gate, id=guild) if isinstance(guild, str) else guild
         return await guild.kickout(user)
 
-    async def fetch_public_channel(self, channel_id: str) -> PublicChannel:
-        """fetch details of a public channel from khl"""
+    async def fetch_public_channel(self, channel_id: str, force_update: bool = False) -> PublicChannel:
+        """fetch details of a public channel from khl
+
+        :param force_update: skip the cache and fetch from khl, the cached object is updated in place
+        """
+        cache = self.gate.cache
+        if cache is not None and not force_update:
+            cached = cache.get_loaded(cache.channels, channel_id)
+            if cached is not None:
+                return cached
         channel_data = await self.gate.exec_req(api.Channel.view(channel_id))
-        return public_channel_factory(_gate_=self.gate, **channel_data)
+        if cache is None:
+            return public_channel_factory(_gate_=self.gate, **channel_data)
+        return cache.upsert(cache.channels, channel_id, channel_data,
+                            lambda: public_channel_factory(_gate_=self.gate, _lazy_loaded_=True, **channel_data))
 
     async def fetch_channel_category(self, category_id: str) -> ChannelCategory:
         """fetch details of a channel category from khl"""
@@ -221,11 +316,19 @@ class Client(Requestable, AsyncRunnable):
         """update channel's settings"""
         channel = channel if isinstance(channel, PublicChannel) else await self.fetch_public_channel(channel)
         channel_data = await channel.update(name, topic, slow_mode)
-        return public_channel_factory(_gate_=self.gate, **channel_data)
+        cache = self.gate.cache
+        if cache is None:
+            return public_channel_factory(_gate_=self.gate, **channel_data)
+        return cache.upsert(cache.channels, channel.id, channel_data,
+                            lambda: public_channel_factory(_gate_=self.gate, _lazy_loaded_=True, **channel_data))
 
     async def delete_channel(self, channel: Union[Channel, str]):
         """delete a channel, permission required"""
-        return await self.gate.exec_req(api.Channel.delete(unpack_id(channel)))
+        channel_id = unpack_id(channel)
+        ret = await self.gate.exec_req(api.Channel.delete(channel_id))
+        if self.gate.cache is not None:
+            self.gate.cache.channels.pop(channel_id)
+        return ret
 
     @staticmethod
     async def send(target: Channel,
@@ -366,4 +469,10 @@ class Client(Requestable, AsyncRunnable):
         await self.gate.exec_req(api.User.offline())
 
     async def start(self):
+        if self.ignore_self_msg:
+            # resolve self once, then msgs from self can be checked without any await
+            try:
+                await self.fetch_me()
+            except Exception as e:
+                log.exception('error raised during fetching self, retry on upcoming msg', exc_info=e)
         await asyncio.gather(self.handle_pkg(), self.gate.run(self._pkg_queue))
@@ -0,0 +1,137 @@
+"""codec: the json codec used across khl.py, the fastest one installed in default
+
+orjson, msgspec and ujson are picked in order if installed, else the stdlib json,
+all of them decode bytes directly, without decoding into str first
+"""
+import json
+import logging
+from enum import Enum
+from typing import Any, Callable, Dict, Union
+
+log = logging.getLogger(__name__)
+
+
+_MISSING = object()
+
+
+def _default(obj: Any) -> Any:
+    """fallback for objects not natively serializable, e.g. cards, card messages"""
+    rep = getattr(obj, '_repr', _MISSING)  # a property building the whole tree, get it only once
+    if rep is not _MISSING:
+        return rep
+    if isinstance(obj, (list, tuple)):  # list subclasses, e.g. CardMessage, serialized via their own __iter__
+        return list(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class JSONCodec:
+    """a pair of json functions
+
+    ``loads`` accepts bytes and str, ``dumps`` returns str"""
+    __slots__ = ('name', 'loads', 'dumps')
+    name: str
+    loads: Callable[[Union[bytes, str]], Any]
+    dumps: Callable[[Any], str]
+
+    def __init__(self, name: str, loads_: Callable[[Union[bytes, str]], Any], dumps_: Callable[[Any], str]):
+        self.name = name
+        self.loads = loads_
+        self.dumps = dumps_
+
+    def __repr__(self):
+        return f'JSONCodec({self.name})'
+
+
+def _make_orjson() -> JSONCodec:
+    # pylint: disable = import-outside-toplevel, import-error, no-member
+    import orjson
+
+    option = orjson.OPT_NON_STR_KEYS
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj, default=_default, option=option).decode()
+
+    return JSONCodec('orjson', orjson.loads, _dumps)
+
+
+def _make_msgspec() -> JSONCodec:
+    import msgspec  # pylint: disable = import-outside-toplevel, import-error
+
+    encoder = msgspec.json.Encoder(enc_hook=_default)
+
+    def _dumps(obj: Any) -> str:
+        return encoder.encode(obj).decode()
+
+    return JSONCodec('msgspec', msgspec.json.Decoder().decode, _dumps)
+
+
+def _make_ujson() -> JSONCodec:
+    import ujson  # pylint: disable = import-outside-toplevel, import-error
+
+    def _dumps(obj: Any) -> str:
+        return ujson.dumps(obj, ensure_ascii=False, default=_default)
+
+    return JSONCodec('ujson', ujson.loads, _dumps)
+
+
+def _make_json() -> JSONCodec:
+
+    def _dumps(obj: Any) -> str:
+        return json.dumps(obj, default=_default)
+
+    return JSONCodec('json', json.loads, _dumps)
+
+
+_FACTORIES: Dict[str, Callable[[], JSONCodec]] = {
+    'orjson': _make_orjson,
+    'msgspec': _make_msgspec,
+    'ujson': _make_ujson,
+    'json': _make_json,
+}
+
+_codec: JSONCodec
+
+
+def use_json_codec(codec: Union[str, JSONCodec, None] = None) -> JSONCodec:
+    """set the json codec used by khl.py
+
+    :param codec: a name in ``orjson``, ``msgspec``, ``ujson``, ``json``, or a JSONCodec,
+        None means the first one installed in that order
+    :return: the codec in use
+    """
+    global _codec  # pylint: disable = global-statement
+    if isinstance(codec, JSONCodec):
+        _codec = codec
+    elif codec is not None:
+        if codec not in _FACTORIES:
+            raise ValueError(f'unknown json codec: {codec}, should be one of {list(_FACTORIES)}')
+        _codec = _FACTORIES[codec]()
+    else:
+        for factory in _FACTORIES.values():
+            try:
+                _codec = factory()
+                break
+            except ImportError:
+                continue
+    log.debug(f'json codec: {_codec.name}')
+    return _codec
+
+
+def json_codec() -> JSONCodec:
+    """the json codec in use"""
+    return _codec
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """decode json with the codec in use, bytes are decoded directly"""
+    return _codec.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    """encode json with the codec in use, cards and card messages are supported"""
+    return _codec.dumps(obj)
+
+
+use_json_codec()
@@ -3,7 +3,7 @@ import asyncio
 import inspect
 import logging
 from copy import copy
-from typing import Callable, Coroutine, List, Union, Pattern, Any, Dict
+from typing import Callable, Coroutine, List, Union, Pattern, Any, Dict, Tuple
 
 from khl import Message, Client
 from .exception import default_exc_handler, TypeEHandler, Exceptions
@@ -17,10 +17,47 @@ log = logging.getLogger(__name__)
 TypeHandler = Callable[..., Coroutine]
 
 
-def _get_arg_by_key_type(annotation, predefined_args: dict):
-    for v in predefined_args.values():
-        if isinstance(v, annotation):
-            return v
+class _CallPlan:
+    """the handler's signature resolved against a set of predefined arg types
+
+    built once per set of types, then every msg only needs to pick args by index"""
+    injected: List[int]
+    to_be_parsed: List[inspect.Parameter]
+    min_args: int
+    max_args: int
+
+    def __init__(self, params: List[inspect.Parameter], predefined_types: Tuple[type, ...]):
+        self.injected = []  # indexes of predefined args, in handler param order
+        self.to_be_parsed = []
+        for p in params:
+            index = _get_index_by_annotation(p.annotation, predefined_types)
+            if index is not None:
+                self.injected.append(index)
+            else:
+                self.to_be_parsed.append(p)
+
+        var_positional = [p for p in self.to_be_parsed if p.kind is inspect.Parameter.VAR_POSITIONAL]
+        self.min_args = sum(1 for p in self.to_be_parsed
+                            if p.kind is not inspect.Parameter.VAR_POSITIONAL and p.default is inspect.Parameter.empty)
+        self.max_args = -1 if var_positional else len(self.to_be_parsed)
+
+    def check_arg_len(self, parsed_args: List):
+        """:raise Exceptions.Handler.ArgLenNotMatched: if parsed_args len not matched to_be_parsed"""
+        if len(parsed_args) < self.min_args or (self.max_args != -1 and len(parsed_args) > self.max_args):
+            raise Exceptions.Handler.ArgLenNotMatched(self.min_args, self.max_args, len(parsed_args))
+
+    def pick(self, predefined_values: Tuple[Any, ...]) -> List[Any]:
+        """pick the predefined args used by the handler"""
+        return [predefined_values[i] for i in self.injected]
+
+
+def _get_index_by_annotation(annotation, predefined_types: Tuple[type, ...]):
+    # an arg is injected if its annotation is a superclass of a predefined arg's type
+    if not isinstance(annotation, type):
+        return None
+    for i, t in enumerate(predefined_types):
+        if issubclass(t, annotation):
+            return i
     return None
 
 
@@ -39,6 +76,9 @@ class Command:
     rules: List[TypeRule]
     exc_handlers: Dict[Any, TypeEHandler]
 
+    _params: List[inspect.Parameter]
+    _plans: Dict[Tuple[type, ...], _CallPlan]
+
     def __init__(
         self,
         name: str,
@@ -53,6 +93,8 @@ class Command:
         if not asyncio.iscoroutinefunction(handler):
             raise TypeError('handler must be a coroutine.')
         self.handler = handler
+        self._params = list(inspect.signature(handler).parameters.values())
+        self._plans = {}
 
         self.name = name or handler.__name__
         if not isinstance(self.name, str):
@@ -98,7 +140,7 @@ class Command:
         :return: a decorator to wrap Command
         """
         if not lexer and regex:
-            lexer = RELexer(regex) if isinstance(regex, str) else regex
+            lexer = RELexer(regex)
 
         def decorator(handler: TypeHandler):
             default_lexer = DefaultLexer(set(prefixes), set([name or handler.__name__] + list(aliases)), case_sensitive)
@@ -129,41 +171,37 @@ class Command:
 
         return decorator
 
-    async def handle(self, msg: Message, client: Client, predefined_kwargs: dict):
+    async def handle(self, msg: Message, client: Client, predefined_kwargs: dict, tokens: List[str] = None):
         """handle msg:
 
         1. check if matched the command
-        2. if matched, execute the command handler"""
+        2. if matched, execute the command handler
+
+        :param tokens: tokens already lexed from the msg, e.g. by the CommandManager, ``self.lexer`` is used if None
+        """
         try:
-            predefined_args, to_be_parsed = self._split_params(predefined_kwargs)
-            parsed_args = await self.parser.parse(msg, client, self.lexer.lex(msg), to_be_parsed)
+            predefined_values = tuple(predefined_kwargs.values())
+            plan = self._get_plan(predefined_values)
+            if tokens is None:
+                tokens = self.lexer.lex(msg)
+            parsed_args = await self.parser.parse(msg, client, tokens, plan.to_be_parsed)
 
             log.info(f'command {self.name} is triggered by msg: {msg.content}')
 
             await self._check_rules(msg)
-            self._check_arg_len(to_be_parsed, parsed_args)
+            plan.check_arg_len(parsed_args)
 
-            await self.handler(*predefined_args, *parsed_args)
+            await self.handler(*plan.pick(predefined_values), *parsed_args)
         except Exception as e:
             return await self._handle_exc(e, msg)
 
-    def _split_params(self, predefined_kwargs: dict) -> (List[Any], List[inspect.Parameter]):
-        """get parameters that need to be parsed according to `ignores`
-
-        :param predefined_kwargs: list of predefined kwargs
-
-        :return: a tuple: (the used predefined args, the params need to be parsed)
-        """
-        predefined_args = []
-        to_be_parsed = []
-        params = list(inspect.signature(self.handler).parameters.values())
-        for p in params:
-            predefined = _get_arg_by_key_type(p.annotation, predefined_kwargs)
-            if predefined is not None:
-                predefined_args.append(predefined)
-            else:
-                to_be_parsed.append(p)
-        return predefined_args, to_be_parsed
+    def _get_plan(self, predefined_values: Tuple[Any, ...]) -> _CallPlan:
+        """get the call plan for predefined args, build it on first use of these arg types"""
+        types = tuple(type(v) for v in predefined_values)
+        plan = self._plans.get(types)
+        if plan is None:
+            plan = self._plans[types] = _CallPlan(self._params, types)
+        return plan
 
     async def _check_rules(self, msg: Message):
         """:raise Exceptions.Handler.RuleNotPassed: if there is rule not passed"""
@@ -172,24 +210,6 @@ class Command:
             if not bool(await wrap_if_coro(rule(msg))):
                 raise Exceptions.Handler.RuleNotPassed(rule)
 
-    @staticmethod
-    def _check_arg_len(to_be_parsed: List[inspect.Parameter], parsed_args: List):
-        """:raise Exceptions.Handler.ArgLenNotMatched: if parsed_args len not matched to_be_parsed"""
-
-        def is_positional(p):
-            return p.kind is inspect.Parameter.VAR_POSITIONAL
-
-        def has_default(p):
-            return p.default is not inspect.Parameter.empty
-
-        minn = sum(map(
-            lambda p: 1 if not is_positional(p) and not has_default(p) else 0,
-            to_be_parsed,
-        ))
-        maxx = -1 if inspect.Parameter.VAR_POSITIONAL in map(lambda x: x.kind, to_be_parsed) else len(to_be_parsed)
-        if len(parsed_args) < minn or (maxx != -1 and len(parsed_args) > maxx):
-            raise Exceptions.Handler.ArgLenNotMatched(minn, maxx, len(parsed_args))
-
     async def _handle_exc(self, e, msg: Message):
         """lookup self.exc_handlers if type(e) exists, execute it"""
         handlers = [self.exc_handlers[h] for h in self.exc_handlers if isinstance(e, h)]
@@ -0,0 +1,169 @@
+"""index: component used in command dispatching, find the commands which may match a msg in one lookup"""
+import logging
+import re
+from typing import Dict, List, Tuple, Iterable, Optional, Pattern
+
+from khl import Message
+from .command import Command
+from .lexer import DefaultLexer, RELexer, tokenize
+
+log = logging.getLogger(__name__)
+
+# numbered backrefs/conditionals are shifted by the wrapping groups, global inline flags can not be nested
+_RE_UNMERGEABLE = re.compile(r'\\[1-9]|\(\?\(|\(\?[aiLmsux]+\)')
+
+TypeMatch = Tuple[Command, Optional[List[str]]]
+
+
+class _RECombination:
+    """
+    RELexer commands sharing the same flags, merged into one alternation pattern: ``(p0)|(p1)|...``
+
+    one ``fullmatch`` finds the first matched command and its groups, the same as running the RELexers in order
+    """
+    _commands: List[Command]
+    _flags: int
+    _patterns: Dict[int, Pattern]  # start position in _commands -> pattern of the commands since then
+    _branches: Dict[int, Dict[int, Tuple[int, int]]]  # start position -> {wrapper group: (cmd pos, n groups)}
+
+    def __init__(self, commands: List[Command], flags: int):
+        self._commands = commands
+        self._flags = flags
+        self._patterns = {}
+        self._branches = {}
+
+    @staticmethod
+    def wrap(pattern: Pattern) -> Optional[str]:
+        """:return: the pattern source wrapped in a group, None if the pattern can not be merged"""
+        source = pattern.pattern
+        if not isinstance(source, str) or _RE_UNMERGEABLE.search(source):
+            return None
+        wrapped = f'({source})'
+        try:
+            re.compile(wrapped, pattern.flags)
+        except re.error:
+            return None
+        return wrapped
+
+    def try_add(self, cmd: Command) -> bool:
+        """add the cmd into the combination, False if its pattern conflicts with others, such as group names"""
+        try:
+            self._compile(self._commands + [cmd])
+        except re.error:
+            return False
+        self._commands.append(cmd)
+        return True
+
+    def _compile(self, commands: List[Command]) -> Pattern:
+        return re.compile('|'.join(self.wrap(cmd.lexer.pattern) for cmd in commands), self._flags)
+
+    def _get_pattern(self, start: int) -> Tuple[Pattern, Dict[int, Tuple[int, int]]]:
+        if start not in self._patterns:
+            branches = {}
+            group = 1
+            for pos in range(start, len(self._commands)):
+                n = self._commands[pos].lexer.pattern.groups
+                branches[group] = (pos, n)
+                group += n + 1
+            self._patterns[start] = self._compile(self._commands[start:])
+            self._branches[start] = branches
+        return self._patterns[start], self._branches[start]
+
+    def match(self, content: str) -> List[TypeMatch]:
+        """all commands whose pattern fully matches the content, with their tokens"""
+        ret = []
+        start = 0
+        while start < len(self._commands):
+            pattern, branches = self._get_pattern(start)
+            m = pattern.fullmatch(content)
+            if not m:
+                break
+            # the wrapper group closes last in its branch, so it is the lastindex
+            pos, n = branches[m.lastindex]
+            wrapper = m.lastindex
+            # the same token rule as RELexer.lex()
+            tokens = [m[wrapper + i] for i in range(1, n + 1) if m.start(wrapper + i) < len(content)]
+            ret.append((self._commands[pos], tokens))
+            start = pos + 1
+        return ret
+
+
+class CommandIndex:
+    """
+    index commands by their DefaultLexer's prefixes and triggers, and merge RELexer patterns,
+    so a msg only needs to be passed to the commands which may match it
+
+    commands using other lexers can not be indexed, they are always treated as candidates
+    """
+    # prefix -> (case-sensitive trigger -> cmds, lowered trigger -> cmds)
+    _by_prefix: Dict[str, Tuple[Dict[str, List[Command]], Dict[str, List[Command]]]]
+    _by_prefix_all: Dict[str, List[Command]]
+    _re_combinations: List[_RECombination]
+    _unindexed: List[Command]
+
+    def __init__(self, commands: Iterable[Command]):
+        self._by_prefix = {}
+        self._by_prefix_all = {}
+        self._re_combinations = []
+        self._unindexed = []
+        re_by_flags: Dict[int, List[_RECombination]] = {}
+        # subclasses may override lex(), can not assume their matching rule, thus check the exact type
+        # pylint: disable = unidiomatic-typecheck
+        for cmd in commands:
+            if type(cmd.lexer) is DefaultLexer:
+                self._add(cmd)
+            elif type(cmd.lexer) is RELexer and _RECombination.wrap(cmd.lexer.pattern) is not None:
+                self._add_re(cmd, re_by_flags)
+            else:
+                self._unindexed.append(cmd)
+
+    def _add(self, cmd: Command):
+        lexer: DefaultLexer = cmd.lexer
+        for prefix in lexer.prefixes:
+            sensitive, insensitive = self._by_prefix.setdefault(prefix, ({}, {}))
+            triggers = sensitive if lexer.case_sensitive else insensitive
+            for trigger in lexer.triggers:
+                triggers.setdefault(trigger, []).append(cmd)
+            self._by_prefix_all.setdefault(prefix, []).append(cmd)
+
+    def _add_re(self, cmd: Command, re_by_flags: Dict[int, List[_RECombination]]):
+        flags = cmd.lexer.pattern.flags
+        combinations = re_by_flags.setdefault(flags, [])
+        for combination in combinations:
+            if combination.try_add(cmd):
+                return
+        # conflicts with all existing combinations, such as duplicate group names: start a new one
+        combination = _RECombination([cmd], flags)
+        combinations.append(combination)
+        self._re_combinations.append(combination)
+
+    def match(self, msg: Message) -> List[TypeMatch]:
+        """get the commands which may match the msg
+
+        :return: list of (command, tokens), tokens is None if the command should lex the msg by itself
+        """
+        content = msg.content
+        if not isinstance(content, str):
+            return [(cmd, None) for cmd in self._unindexed]
+
+        candidates = []
+        for prefix, (sensitive, insensitive) in self._by_prefix.items():
+            if not content.startswith(prefix):
+                continue
+            try:
+                # tokens are cached, the matched lexers will reuse them
+                tokens = tokenize(content[len(prefix):])
+            except ValueError:
+                # malformed content: let the lexers raise and report it
+                candidates.extend(self._by_prefix_all[prefix])
+                continue
+            trigger = tokens[0] if tokens else ''
+            candidates.extend(sensitive.get(trigger, ()))
+            if insensitive:
+                candidates.extend(insensitive.get(trigger.lower(), ()))
+        candidates.extend(self._unindexed)
+        ret = [(cmd, None) for cmd in dict.fromkeys(candidates)]  # dedup while keeping order
+
+        for combination in self._re_combinations:
+            ret.extend(combination.match(content))
+        return ret
@@ -1,14 +1,40 @@
+import functools
 import logging
 import re
 import shlex
 from abc import ABC, abstractmethod
-from typing import List, Set, Union, Pattern
+from typing import List, Set, Union, Pattern, Tuple
 
 from khl import Message
 from .exception import Exceptions
 
 log = logging.getLogger(__name__)
 
+# chars which make shlex.split() differ from a plain whitespace split
+_SHLEX_SPECIAL = ('"', "'", '\\')
+_RE_SHLEX_WHITESPACE = re.compile(r'[ \t\r\n]+')
+
+
+def tokenize(content: str, fast: bool = True) -> List[str]:
+    """
+    split content into tokens like ``shlex.split()``
+
+    the result is cached, so commands sharing a prefix only tokenize a msg once
+
+    :param content: content to split
+    :param fast: use ``str`` split if there is no quote or escape in content, the result is the same as shlex
+    :raises ValueError: if shlex.split() failed
+    """
+    return list(_tokenize_cached(content, fast))
+
+
+@functools.lru_cache(maxsize=256)
+def _tokenize_cached(content: str, fast: bool) -> Tuple[str, ...]:
+    if fast and not any(c in content for c in _SHLEX_SPECIAL):
+        # not str.split(): shlex only splits on ' \t\r\n', while str.split() also splits on unicode whitespaces
+        return tuple(t for t in _RE_SHLEX_WHITESPACE.split(content) if t)
+    return tuple(shlex.split(content))
+
 
 class Lexer(ABC):
     """
@@ -34,11 +60,13 @@ class DefaultLexer(Lexer):
     triggers: Set[str]
 
     case_sensitive: bool
+    fast_split: bool
 
-    def __init__(self, prefixes: Set[str], triggers: Set[str], case_sensitive: bool):
+    def __init__(self, prefixes: Set[str], triggers: Set[str], case_sensitive: bool, fast_split: bool = True):
         self.prefixes = prefixes
         self.triggers = triggers
         self.case_sensitive = case_sensitive
+        self.fast_split = fast_split
         if not self.case_sensitive:
             self.triggers = set(map(lambda t: t.lower(), self.triggers))
 
@@ -58,7 +86,7 @@ class DefaultLexer(Lexer):
 
         for prefix in matched_prefixes:
             try:
-                arg_list = shlex.split(msg.content[len(prefix):])
+                arg_list = tokenize(msg.content[len(prefix):], self.fast_split)
             except Exception as e:
                 raise DefaultLexer.MalformedContent(msg) from e
             a0 = arg_list[0] if len(arg_list) > 0 else ''
@@ -5,6 +5,7 @@ from typing import Optional, List, Union, Pattern, Dict, Any
 from khl import Message, Client
 from .command import Command
 from .exception import TypeEHandler
+from .index import CommandIndex
 from .lexer import Lexer, DefaultLexer
 from .parser import Parser
 from .rule import TypeRule
@@ -15,9 +16,11 @@ log = logging.getLogger(__name__)
 class CommandManager:
     """aggregates commands as a system, and provide API as a whole"""
     _cmd_map: Dict[str, Command]
+    _index: Optional[CommandIndex]
 
     def __init__(self):
         self._cmd_map = {}
+        self._index = None
 
     # why disable duplicate-code:
     # the duplicated code is the param list, used to provide auto complete/coding hints in IDE
@@ -84,12 +87,30 @@ class CommandManager:
         cmd = self[name]
         if cmd:
             del self._cmd_map[name]
+            self._index = None
         return cmd
 
-    async def handle(self, loop, client: Client, msg: Message, filter_args: dict):
-        """pass msg into all commands in self, handle it concurrently"""
-        for cmd in self._cmd_map.values():
-            asyncio.ensure_future(cmd.handle(msg, client, filter_args), loop=loop)
+    async def handle(self, loop, client: Client, msg: Message, filter_args: dict):  # pylint: disable = unused-argument
+        """pass msg into commands which may match it, handle it concurrently
+
+        returns after all matched commands finished, thus the client's dispatcher can bound/order the commands
+
+        :param loop: not used anymore, kept for compatibility
+        """
+        await asyncio.gather(*[cmd.handle(msg, client, filter_args, tokens) for cmd, tokens in self.index.match(msg)])
+
+    @property
+    def index(self) -> CommandIndex:
+        """the dispatch index of commands, rebuilt lazily after commands changed
+
+        call ``rebuild_index()`` if a command's lexer is modified in place"""
+        if self._index is None:
+            self._index = CommandIndex(self._cmd_map.values())
+        return self._index
+
+    def rebuild_index(self):
+        """drop the dispatch index, it will be rebuilt on next msg"""
+        self._index = None
 
     def update_prefixes(self, *prefixes: str) -> List[Command]:
         """update command prefixes in the Manager if command uses DefaultLexer
@@ -103,12 +124,14 @@ class CommandManager:
                 continue
             cmd.lexer.prefixes = prefixes
             updated.append(cmd)
+        self._index = None
         return updated
 
     def __setitem__(self, name: str, cmd: Command):
         if cmd.name in self._cmd_map:
             raise ValueError(f'cmd: {cmd.name} already exists')
         self._cmd_map[cmd.name] = cmd
+        self._index = None
         log.debug(f'command: {cmd.name} added')
 
     def __getitem__(self, item) -> Optional[Command]:
@@ -6,6 +6,7 @@ from .guild import Guild
 
 class Context(Requestable):
     """carries environment context info for a message"""
+    __slots__ = ('channel', 'guild', 'gate')
     channel: Channel
     guild: Guild
 
@@ -0,0 +1,301 @@
+"""dispatcher: schedule pkgs received by the Receiver onto the Client's handlers"""
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from enum import Enum
+from typing import Callable, Coroutine, Dict, Iterable, Optional, List
+
+from ._types import MessageTypes
+
+log = logging.getLogger(__name__)
+
+TypeProcessor = Callable[[Dict], Coroutine]
+
+
+class OverflowPolicies(Enum):
+    """
+    what to do when a bounded pkg queue is full
+    """
+    BLOCK = 'block'
+    """
+    block the receiver until there is space
+    """
+    DROP_OLDEST = 'drop_oldest'
+    """
+    drop the oldest pkg in the queue to make space
+    """
+    DROP_TYPES = 'drop_types'
+    """
+    drop upcoming pkgs of the given MessageTypes, block on others
+    """
+
+
+class DispatchMetrics:
+    """counters of a dispatcher, for monitoring"""
+    received: int
+    dropped: int
+    fetched: int
+    processed: int
+    max_depth: int
+    total_wait: float
+    max_wait: float
+
+    def __init__(self):
+        self.received = 0
+        self.dropped = 0
+        self.fetched = 0
+        self.processed = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def avg_wait(self) -> float:
+        """average seconds a pkg waited in queue before being processed"""
+        return self.total_wait / self.fetched if self.fetched > 0 else 0.0
+
+    def __repr__(self):
+        return f'DispatchMetrics(received={self.received}, dropped={self.dropped}, processed={self.processed}, ' \
+               f'max_depth={self.max_depth}, avg_wait={self.avg_wait:.3f}s, max_wait={self.max_wait:.3f}s)'
+
+
+class PkgQueue(asyncio.Queue):
+    """pkg queue with an overflow policy, records queue depth and wait time into metrics"""
+    overflow: OverflowPolicies
+    metrics: DispatchMetrics
+
+    def __init__(self,
+                 maxsize: int = 0,
+                 *,
+                 overflow: OverflowPolicies = OverflowPolicies.BLOCK,
+                 drop_types: Iterable[MessageTypes] = (),
+                 metrics: DispatchMetrics = None):
+        super().__init__(maxsize)
+        self.overflow = overflow
+        self.metrics = metrics or DispatchMetrics()
+        self._drop_types = {int(t) for t in drop_types}
+
+    async def put(self, item: Dict):
+        if self.full():
+            if self.overflow == OverflowPolicies.DROP_OLDEST:
+                super()._get()  # bypass the wait time record in self._get()
+                self.task_done()
+                self.metrics.dropped += 1
+            elif self.overflow == OverflowPolicies.DROP_TYPES and item.get('type') in self._drop_types:
+                self.metrics.received += 1
+                self.metrics.dropped += 1
+                return
+        await super().put(item)
+
+    def _put(self, item):
+        super()._put((time.monotonic(), item))
+        self.metrics.received += 1
+        self.metrics.max_depth = max(self.metrics.max_depth, self.qsize())
+
+    def _get(self):
+        enqueued_at, item = super()._get()
+        wait = time.monotonic() - enqueued_at
+        self.metrics.fetched += 1
+        self.metrics.total_wait += wait
+        self.metrics.max_wait = max(self.metrics.max_wait, wait)
+        return item
+
+
+class Dispatcher(ABC):
+    """
+    consumes the pkg queue, and decides how many pkgs are processed concurrently and in which order
+
+    used by the Client, the default Client without a Dispatcher schedules every handler as soon as pkg arrives
+    """
+    metrics: DispatchMetrics
+    _queue: Optional[asyncio.Queue]
+
+    def __init__(self):
+        self.metrics = DispatchMetrics()
+        self._queue = None
+
+    def make_queue(self) -> asyncio.Queue:
+        """create the pkg queue, which the Receiver puts pkgs into"""
+        self._queue = asyncio.Queue()
+        return self._queue
+
+    @property
+    def depth(self) -> int:
+        """current count of pkgs waiting in queue"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @abstractmethod
+    async def run(self, queue: asyncio.Queue, process: TypeProcessor):
+        """consume pkgs from queue forever, ``await process(pkg)`` runs all handlers of the pkg"""
+        raise NotImplementedError
+
+    async def _process_safe(self, queue: asyncio.Queue, process: TypeProcessor, pkg: Dict):
+        try:
+            await process(pkg)
+        except Exception as e:
+            log.exception('error raised during pkg processing', exc_info=e)
+        finally:
+            queue.task_done()
+            self.metrics.processed += 1
+
+
+class WorkerPoolDispatcher(Dispatcher):
+    """
+    a fixed pool of workers consume a bounded pkg queue,
+    at most ``workers`` pkgs are processed concurrently, others wait in queue
+
+    when the queue is full, the ``overflow`` policy applies, refer to OverflowPolicies
+    """
+    workers: int
+    queue_size: int
+    overflow: OverflowPolicies
+    drop_types: Iterable[MessageTypes]
+
+    def __init__(self,
+                 workers: int = 8,
+                 queue_size: int = 1000,
+                 *,
+                 overflow: OverflowPolicies = OverflowPolicies.BLOCK,
+                 drop_types: Iterable[MessageTypes] = ()):
+        super().__init__()
+        if workers <= 0:
+            raise ValueError('workers should be positive')
+        self.workers = workers
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.drop_types = tuple(drop_types)
+
+    def make_queue(self) -> asyncio.Queue:
+        self._queue = PkgQueue(self.queue_size,
+                               overflow=self.overflow,
+                               drop_types=self.drop_types,
+                               metrics=self.metrics)
+        return self._queue
+
+    async def run(self, queue: asyncio.Queue, process: TypeProcessor):
+        await asyncio.gather(*[self._work(queue, process) for _ in range(self.workers)])
+
+    async def _work(self, queue: asyncio.Queue, process: TypeProcessor):
+        while True:
+            pkg = await queue.get()
+            await self._process_safe(queue, process, pkg)
+
+
+class LaneDispatcher(Dispatcher):
+    """
+    shards pkgs onto lanes by channel: pkgs in the same channel are processed one by one in arrival order,
+    while different lanes run in parallel
+
+    a pkg is sharded by its ``target_id``, or the chat code for private chats.
+
+    a lane holds at most ``lane_size`` pkgs, the dispatching never waits on a full lane, thus a busy channel does not
+    hold up others. upcoming pkgs of a full lane are handled by the ``overflow`` policy:
+
+    - ``DROP_OLDEST``: the oldest pkg in the lane is dropped
+    - ``DROP_TYPES``: pkgs of ``drop_types`` are dropped, others spill over
+    - ``BLOCK``: the pkg spills over, waiting out of the lane in order
+
+    spilled pkgs of all lanes are bounded by ``queue_size`` in total, beyond which the dispatching blocks,
+    thus pkgs stay in the main queue, where the ``overflow`` policy applies as well
+    """
+    lanes: int
+    lane_size: int
+    queue_size: int
+    overflow: OverflowPolicies
+    drop_types: Iterable[MessageTypes]
+    _lanes: List[asyncio.Queue]
+    _spills: List[deque]
+    _spilled: int
+    _spill_space: Optional[asyncio.Event]
+
+    def __init__(self,
+                 lanes: int = 16,
+                 lane_size: int = 100,
+                 queue_size: int = 1000,
+                 *,
+                 overflow: OverflowPolicies = OverflowPolicies.BLOCK,
+                 drop_types: Iterable[MessageTypes] = ()):
+        super().__init__()
+        if lanes <= 0:
+            raise ValueError('lanes should be positive')
+        self.lanes = lanes
+        self.lane_size = lane_size
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.drop_types = tuple(drop_types)
+        self._lanes = []
+        self._spills = []
+        self._spilled = 0
+        self._spill_space = None
+
+    def make_queue(self) -> asyncio.Queue:
+        self._queue = PkgQueue(self.queue_size,
+                               overflow=self.overflow,
+                               drop_types=self.drop_types,
+                               metrics=self.metrics)
+        return self._queue
+
+    @property
+    def lane_depths(self) -> List[int]:
+        """current count of pkgs waiting in each lane, spilled ones included"""
+        return [lane.qsize() + len(spill) for lane, spill in zip(self._lanes, self._spills)]
+
+    @staticmethod
+    def lane_key(pkg: Dict) -> str:
+        """the key to shard pkg onto lanes: the channel where the pkg comes from"""
+        if pkg.get('channel_type') == 'PERSON':
+            code = (pkg.get('extra') or {}).get('code')
+            if code:
+                return code
+        return pkg.get('target_id', '')
+
+    async def run(self, queue: asyncio.Queue, process: TypeProcessor):
+        self._lanes = [asyncio.Queue(self.lane_size) for _ in range(self.lanes)]
+        self._spills = [deque() for _ in range(self.lanes)]
+        self._spilled = 0
+        self._spill_space = asyncio.Event()
+        workers = [self._work(lane, spill, queue, process) for lane, spill in zip(self._lanes, self._spills)]
+        await asyncio.gather(self._route(queue), *workers)
+
+    async def _route(self, queue: asyncio.Queue):
+        drop_types = {int(t) for t in self.drop_types}
+        while True:
+            while 0 < self.queue_size <= self._spilled:
+                self._spill_space.clear()
+                await self._spill_space.wait()
+            pkg = await queue.get()
+            try:
+                index = hash(self.lane_key(pkg)) % self.lanes
+            except Exception as e:
+                log.exception('error raised during pkg routing', exc_info=e)
+                queue.task_done()
+                continue
+            lane, spill = self._lanes[index], self._spills[index]
+            if not lane.full() and not spill:
+                lane.put_nowait(pkg)
+            elif self.overflow == OverflowPolicies.DROP_OLDEST:  # never spills, thus the oldest is in the lane
+                self._drop(queue)
+                lane.get_nowait()
+                lane.task_done()
+                lane.put_nowait(pkg)
+            elif self.overflow == OverflowPolicies.DROP_TYPES and pkg.get('type') in drop_types:
+                self._drop(queue)
+            else:
+                spill.append(pkg)
+                self._spilled += 1
+
+    def _drop(self, queue: asyncio.Queue):
+        queue.task_done()
+        self.metrics.dropped += 1
+
+    async def _work(self, lane: asyncio.Queue, spill: deque, queue: asyncio.Queue, process: TypeProcessor):
+        while True:
+            pkg = await lane.get()
+            if spill:  # refill the lane in order
+                lane.put_nowait(spill.popleft())
+                self._spilled -= 1
+                self._spill_space.set()
+            await self._process_safe(queue, process, pkg)
+            lane.task_done()
@@ -4,6 +4,7 @@ from typing import List
 
 class Game:
     """represents a game used in playing state"""
+    __slots__ = ('id', 'name', 'type', 'options', 'kmhook_admin', 'process_name', 'product_name', 'icon')
     id: int
     name: str
     type: int
@@ -1,9 +1,11 @@
 """gateway related stuff"""
 import asyncio
 from abc import ABC
-from typing import Union, List
+from typing import Union, List, Optional, AsyncIterator
 
 from .api import _Req
+from .cache import EntityCache
+from .ratelimiter import Priorities
 from .receiver import Receiver
 from .requester import HTTPRequester
 
@@ -16,23 +18,35 @@ class Gateway:
     """
     requester: HTTPRequester
     receiver: Receiver
+    cache: Optional[EntityCache]
 
-    def __init__(self, requester: HTTPRequester, receiver: Receiver):
+    def __init__(self, requester: HTTPRequester, receiver: Receiver, *, cache: EntityCache = None):
+        """
+        :param cache: shared by all objects using this gateway, None in default: entities are always fetched from khl
+        """
         self.requester = requester
         self.receiver = receiver
+        self.cache = cache
 
     async def request(self, method: str, route: str, **params) -> Union[dict, list]:
         """execute raw request, this is just a wrapper for convenience"""
         return await self.requester.request(method, route, **params)
 
-    async def exec_req(self, r: _Req):
-        """execute request, this is just a wrapper for convenience"""
-        return await self.requester.exec_req(r)
+    async def exec_req(self, r: _Req, priority: Priorities = None):
+        """execute request, this is just a wrapper for convenience
+
+        :param priority: used by the ratelimiter to schedule requests in a throttled bucket, refer to Priorities
+        """
+        return await self.requester.exec_req(r, priority)
 
     async def exec_paged_req(self, r: _Req, **kwargs) -> List:
         """execute paged request, this is just a wrapper for convenience"""
         return await self.requester.exec_paged_req(r, **kwargs)
 
+    def iter_paged_req(self, r: _Req, **kwargs) -> AsyncIterator:
+        """iterate paged request lazily, this is just a wrapper for convenience"""
+        return self.requester.iter_paged_req(r, **kwargs)
+
     async def run(self, in_queue: asyncio.Queue):
         """run the receiver"""
         self.receiver.pkg_queue = in_queue
@@ -48,4 +62,5 @@ class Requestable(ABC):
 
         `Guild`: guild.get_roles() to fetch role list from khl
     """
+    __slots__ = ()
     gate: Gateway
@@ -1,11 +1,13 @@
 """guild related stuffs: Guild, ChannelCategory"""
+import functools
 import logging
 import time
 import warnings
-from typing import List, Union, Dict, IO
+from typing import List, Union, Dict, IO, Optional, AsyncIterator
 
 from . import api
 from ._types import ChannelTypes, GuildMuteTypes, BadgeTypes
+from .cache import EntityCache
 from .channel import Channel, public_channel_factory, PublicChannel, PublicVoiceChannel, PublicTextChannel
 from .gateway import Requestable
 from .interface import LazyLoadable
@@ -19,6 +21,7 @@ log = logging.getLogger(__name__)
 
 class GuildBoost:
     """Guild boost"""
+    __slots__ = ('user_id', 'guild_id', 'start_time', 'end_time', 'user')
     user_id: str
     guild_id: str
     start_time: int
@@ -37,6 +40,7 @@ class GuildEmoji(Requestable):
     """
     The custom emojis in the guild
     """
+    __slots__ = ('gate', 'guild_id', 'name', 'id', 'user')
     guild_id: str
     name: str
     id: str
@@ -60,6 +64,8 @@ class GuildEmoji(Requestable):
 
 class ChannelCategory(PermissionHolder, Requestable):
     """represent a channel set"""
+    __slots__ = ('_id', 'gate', 'name', 'master_id', 'guild_id', 'level', 'limit_amount', '_channels', 'permission',
+                 '_loaded')
 
     _id: str
     name: str
@@ -145,6 +151,9 @@ class Guild(LazyLoadable, Requestable):
 
     represent a server where users gathered in and contains channels
     """
+    __slots__ = ('id', 'name', 'topic', 'master_id', 'icon', 'notify_type', 'region', 'enable_open', 'open_id',
+                 'default_channel_id', 'welcome_channel_id', '_roles', '_channel_categories', '_channels', '_loaded',
+                 'gate')
     id: str
     name: str
     topic: str
@@ -185,6 +194,9 @@ class Guild(LazyLoadable, Requestable):
         self._update_fields(**(await self.gate.exec_req(api.Guild.view(self.id))))
         self._loaded = True
 
+    def _get_cache(self) -> Optional[EntityCache]:
+        return self.gate.cache if self.gate is not None else None
+
     async def fetch_channel_category_list(self, force_update: bool = True) -> List[ChannelCategory]:
         """fetch all channel category as a list"""
         await self.fetch_channel_list(force_update)
@@ -194,14 +206,18 @@ class Guild(LazyLoadable, Requestable):
         """fetch channel list from khl server"""
         if force_update or self._channels is None:
             raw_list = await self.gate.exec_paged_req(api.Channel.list(guild_id=self.id))
+            cache = self._get_cache()
             channels: List[PublicChannel] = []
             channel_categories: Dict[str, ChannelCategory] = {}
             for i in raw_list:
                 if i['is_category']:
                     cc = ChannelCategory(_gate_=self.gate, _guild_id_=self.id, **i)
                     channel_categories[cc.id] = cc
-                else:
+                elif cache is None:
                     channels.append(public_channel_factory(_gate_=self.gate, **i))
+                else:  # keep the identity of cached channels
+                    channels.append(cache.upsert(cache.channels, i['id'], i, functools.partial(
+                        public_channel_factory, _gate_=self.gate, _lazy_loaded_=True, **i)))
 
             self._channels = []
             for i in channels:
@@ -250,12 +266,24 @@ class Guild(LazyLoadable, Requestable):
         """list users in the guild/a channel belongs to the guild
 
         paged req, support standard pagination args"""
+        users = await self.gate.exec_paged_req(self._user_list_req(channel), **kwargs)
+        return [User(_gate_=self.gate, _lazy_loaded_=True, **i) for i in users]
+
+    async def iter_users(self, channel: Union[Channel, str] = None, **kwargs) -> AsyncIterator[User]:
+        """iterate users in the guild/a channel belongs to the guild, page by page
+
+        ``async for user in guild.iter_users(): ...``
+
+        paged req, support standard pagination args and ``prefetch``"""
+        async for i in self.gate.iter_paged_req(self._user_list_req(channel), **kwargs):
+            yield User(_gate_=self.gate, _lazy_loaded_=True, **i)
+
+    def _user_list_req(self, channel: Union[Channel, str] = None):
         cid = channel.id if isinstance(channel, Channel) else channel
         params = {'guild_id': self.id}
         if cid is not None:
             params['channel_id'] = cid
-        users = await self.gate.exec_paged_req(api.Guild.userList(**params), **kwargs)
-        return [User(_gate_=self.gate, _lazy_loaded_=True, **i) for i in users]
+        return api.Guild.userList(**params)
 
     async def fetch_joined_channel(self,
                                    user: Union[User, str],
@@ -266,36 +294,70 @@ class Guild(LazyLoadable, Requestable):
             api.ChannelUser.getJoinedChannel(page=page, page_size=page_size, guild_id=self.id, user_id=unpack_id(user)))
         return [PublicVoiceChannel(_gate_=self.gate, _lazy_loaded_=True, **i) for i in channels]
 
-    async def fetch_user(self, user_id: str) -> GuildUser:
+    async def fetch_user(self, user_id: str, force_update: bool = False) -> GuildUser:
         """get user object from user_id, can only fetch user in current guild
+
+        :param force_update: skip the cache and fetch from khl, the cached object is updated in place
         """
+        cache = self._get_cache()
+        if cache is not None and not force_update:
+            cached = cache.get_loaded(cache.members, (self.id, user_id))
+            if cached is not None:
+                return cached
         user = await self.gate.exec_req(api.User.view(user_id=user_id, guild_id=self.id))
-        return GuildUser(guild_id=self.id, _gate_=self.gate, _lazy_loaded_=True, **user)
+        if cache is None:
+            return GuildUser(guild_id=self.id, _gate_=self.gate, _lazy_loaded_=True, **user)
+        return cache.upsert(cache.members, (self.id, user_id), {'guild_id': self.id, **user},
+                            lambda: GuildUser(guild_id=self.id, _gate_=self.gate, _lazy_loaded_=True, **user))
 
     async def set_user_nickname(self, user: Union[User, str], nickname: str):
         """set the user's nickname in this guild"""
         await self.gate.exec_req(api.Guild.nickname(guild_id=self.id, nickname=nickname, user_id=unpack_id(user)))
 
-    async def fetch_roles(self, force_update: bool = True) -> List[Role]:
-        """fetch the role list in the guild"""
-        if force_update or self._roles is None:
-            raw_list = await self.gate.exec_paged_req(api.GuildRole.list(guild_id=self.id))
-            self._roles = [Role(**i) for i in raw_list]
+    async def fetch_roles(self, force_update: bool = None) -> List[Role]:
+        """fetch the role list in the guild
+
+        :param force_update: None in default: use the gate's cache if enabled, else always fetch from khl
+        """
+        cache = self._get_cache()
+        if force_update is None:
+            force_update = cache is None
+        if not force_update:
+            roles = cache.roles.get(self.id) if cache is not None else self._roles
+            if roles is not None:
+                self._roles = roles
+                return roles
+        raw_list = await self.gate.exec_paged_req(api.GuildRole.list(guild_id=self.id))
+        self._roles = [Role(**i) for i in raw_list]
+        if cache is not None:
+            cache.roles.put(self.id, self._roles)
         return self._roles
 
+    def _expire_cached_roles(self):
+        cache = self._get_cache()
+        if cache is not None:
+            cache.roles.pop(self.id)
+
     async def create_role(self, role_name: str) -> Role:
         """create a role in the guild"""
-        return Role(**(await self.gate.exec_req(api.GuildRole.create(guild_id=self.id, name=role_name))))
+        role = Role(**(await self.gate.exec_req(api.GuildRole.create(guild_id=self.id, name=role_name))))
+        self._expire_cached_roles()
+        return role
 
     async def update_role(self, new_role: Role) -> Role:
         """update a role in the guild
 
         :param new_role an edited role object"""
-        return Role(**(await self.gate.exec_req(api.GuildRole.update(guild_id=self.id, **vars(new_role)))))
+        fields = {k: getattr(new_role, k) for k in Role.__slots__}
+        role = Role(**(await self.gate.exec_req(api.GuildRole.update(guild_id=self.id, **fields))))
+        self._expire_cached_roles()
+        return role
 
     async def delete_role(self, role: Union[int, Role]):
         """delete a role from the guild"""
-        return await self.gate.exec_req(api.GuildRole.delete(guild_id=self.id, role_id=unpack_id(role)))
+        ret = await self.gate.exec_req(api.GuildRole.delete(guild_id=self.id, role_id=unpack_id(role)))
+        self._expire_cached_roles()
+        return ret
 
     async def grant_role(self, user: Union[User, str], role: Union[Role, int]):
         """
@@ -390,6 +452,13 @@ class Guild(LazyLoadable, Requestable):
         emojis = await self.gate.exec_paged_req(api.GuildEmoji.list(guild_id=self.id))
         return [GuildEmoji(_gate_=self.gate, guild_id=self.id, **i) for i in emojis]
 
+    async def iter_emojis(self, **kwargs) -> AsyncIterator[GuildEmoji]:
+        """iterate guild emojis, page by page
+
+        paged req, support standard pagination args and ``prefetch``"""
+        async for i in self.gate.iter_paged_req(api.GuildEmoji.list(guild_id=self.id), **kwargs):
+            yield GuildEmoji(_gate_=self.gate, guild_id=self.id, **i)
+
     async def create_emoji(self, emoji: Union[IO, str], *, name: str = None) -> GuildEmoji:
         """upload a custom emoji to the guild
 
@@ -3,6 +3,7 @@ from typing import List, Tuple
 
 class Intimacy:
     """the user's intimacy info"""
+    __slots__ = ('user_id', 'img_url', 'social_info', 'last_read', 'score', 'img_list')
     user_id: str
     img_url: str
     social_info: str
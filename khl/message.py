@@ -1,19 +1,21 @@
 from abc import ABC, abstractmethod
 from typing import Any, List, Dict, Union, Optional
 
-import json
-
 from . import api
 from .channel import PublicTextChannel, PrivateChannel
+from .codec import dumps
 from .context import Context
 from .gateway import Requestable
 from .guild import Guild
 from ._types import MessageTypes, ChannelPrivacyTypes, EventTypes
 from .user import User, GuildUser
 
+_UNSET = object()  # placeholder of lazy fields, which can be None after loaded
+
 
 class QuotedMessage(Requestable, ABC):
     """Basic quote message"""
+    __slots__ = ('_msg_id', '_type', '_author', 'content', 'create_at', 'gate')
     _msg_id: str
     _type: int
     _author: User
@@ -45,6 +47,7 @@ class QuotedMessage(Requestable, ABC):
 
 class PublicQuotedMessage(QuotedMessage):
     """quote messages sent in a `PublicTextChannel`"""
+    __slots__ = ()
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -58,6 +61,7 @@ class PublicQuotedMessage(QuotedMessage):
 
 class PrivateQuotedMessage(QuotedMessage):
     """quote messages sent in a `PrivateChannel`"""
+    __slots__ = ()
     _author: User
 
     def __init__(self, **kwargs):
@@ -78,6 +82,8 @@ class RawMessage(ABC):
         1. Message (sent by users, those normal chats such as TEXT/IMG etc.)
         2. Event (sent by system, such as notifications and broadcasts)
     """
+    __slots__ = ('_type', '_channel_type', 'target_id', 'author_id', 'content', '_msg_id', 'msg_timestamp', 'nonce',
+                 'extra')
 
     _type: int
     _channel_type: str
@@ -125,23 +131,34 @@ class Message(RawMessage, Requestable, ABC):
     now there are two types of message:
         1. ChannelMessage: sent in a guild channel
         2. PrivateMessage: sent in a private chat
+
+    objects in the message such as author, ctx and quote are built from ``extra`` on first access,
+    thus msgs not used by any handler cost no more than the raw pkg
     """
-    _ctx: Context
-    _author: User
+    __slots__ = ('gate', '_ctx', '_author', '_quote')
+    _ctx: Optional[Context]
+    _author: Optional[User]
     _quote: Optional[QuotedMessage]
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.gate = kwargs.get('_gate_', None)
+        self._ctx = None
+        self._author = None
+        self._quote = _UNSET
 
     @property
     def author(self) -> User:
         """message author"""
+        if self._author is None:
+            self._author = self._make_author()
         return self._author
 
     @property
     def ctx(self) -> Context:
         """message context: channel, guild etc."""
+        if self._ctx is None:
+            self._ctx = self._make_ctx()
         return self._ctx
 
     @property
@@ -151,8 +168,22 @@ class Message(RawMessage, Requestable, ABC):
 
         If the quote does not exist, it will return None
         """
+        if self._quote is _UNSET:
+            self._quote = self._make_quote()
         return self._quote
 
+    @abstractmethod
+    def _make_author(self) -> User:
+        """build author from extra"""
+
+    @abstractmethod
+    def _make_ctx(self) -> Context:
+        """build ctx from extra"""
+
+    @abstractmethod
+    def _make_quote(self) -> Optional[QuotedMessage]:
+        """build quote from extra, None if not quoted"""
+
     @abstractmethod
     async def add_reaction(self, emoji: str):
         """add emoji to msg's reaction list
@@ -209,34 +240,56 @@ class PublicMessage(Message):
     """
     Messages sent in a `PublicTextChannel`
     """
+    __slots__ = ('_channel', '_guild')
+
+    _channel: Optional[PublicTextChannel]
+    _guild: Optional[Guild]
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        channel = PublicTextChannel(id=self.target_id, name=self.extra['channel_name'], _gate_=self.gate)
-        guild = Guild(id=self.extra['guild_id'], _gate_=self.gate)
-        self._ctx = Context(channel=channel, guild=guild, _gate_=self.gate)
-        self._author = GuildUser(**self.extra['author'], _gate_=self.gate, _lazy_loaded_=True)
-        if 'quote' in self.extra:
-            self._quote = PublicQuotedMessage(**self.extra['quote'], _gate_=self.gate, _lazy_loaded_=True)
-        else:
-            self._quote = None
+        self._channel = None
+        self._guild = None
+
+    def _make_author(self) -> GuildUser:
+        return GuildUser(**self.extra['author'], _gate_=self.gate, _lazy_loaded_=True)
+
+    def _make_ctx(self) -> Context:
+        return Context(channel=self.channel, guild=self.guild, _gate_=self.gate)
+
+    def _make_quote(self) -> Optional[PublicQuotedMessage]:
+        if 'quote' not in self.extra:
+            return None
+        return PublicQuotedMessage(**self.extra['quote'], _gate_=self.gate, _lazy_loaded_=True)
 
     @property
     def author(self) -> GuildUser:
         """message author"""
-        return self._author
+        return super().author
 
     @property
     def guild(self) -> Guild:
         """the guild where the message in"""
-        return self.ctx.guild
+        if self._guild is None:
+            guild_id = self.extra['guild_id']
+            cache = self.gate.cache if self.gate is not None else None
+            if cache is None:
+                self._guild = Guild(id=guild_id, _gate_=self.gate)
+            else:  # share one Guild among msgs, thus its loaded data and fetched roles
+                self._guild = cache.guilds.peek(guild_id) or cache.guilds.put(guild_id,
+                                                                              Guild(id=guild_id, _gate_=self.gate))
+        return self._guild
 
     @property
     def channel(self) -> PublicTextChannel:
         """the channel where the message in"""
-        if isinstance(self.ctx.channel, PublicTextChannel):
-            return self.ctx.channel
-        raise ValueError('PublicMessage should be placed in PublicTextChannel')
+        if self._channel is None:
+            cache = self.gate.cache if self.gate is not None else None
+            cached = cache.channels.peek(self.target_id) if cache is not None else None
+            if isinstance(cached, PublicTextChannel):
+                self._channel = cached
+            else:
+                self._channel = PublicTextChannel(id=self.target_id, name=self.extra['channel_name'], _gate_=self.gate)
+        return self._channel
 
     @property
     def mention(self) -> List[str]:
@@ -265,7 +318,7 @@ class PublicMessage(Message):
 
         If the quote does not exist, it will return None
         """
-        return self._quote
+        return super().quote
 
     async def add_reaction(self, emoji: str):
         return await self.gate.exec_req(api.Message.addReaction(msg_id=self.id, emoji=emoji))
@@ -276,7 +329,7 @@ class PublicMessage(Message):
 
     async def update(self, content: Union[str, List], quote: str = None, temp_target_id: str = None):
         if isinstance(content, List):
-            content = json.dumps(content)
+            content = dumps(content)
         params = {'msg_id': self.id, 'content': content}
         if quote is not None:
             params['quote'] = quote
@@ -302,16 +355,24 @@ class PrivateMessage(Message):
     """
     Messages sent in a `PrivateChannel`
     """
+    __slots__ = ('_channel', )
+
+    _channel: Optional[PrivateChannel]
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self._channel = PrivateChannel(code=self.extra['code'], target_info=self.extra['author'], _gate_=self.gate)
-        self._ctx = Context(channel=self._channel, _gate_=self.gate)
-        self._author = User(**self.extra['author'], _gate_=self.gate, _lazy_loaded_=True)
-        if 'quote' in self.extra:
-            self._quote = PrivateQuotedMessage(**self.extra['quote'], _gate_=self.gate, _lazy_loaded_=True)
-        else:
-            self._quote = None
+        self._channel = None
+
+    def _make_author(self) -> User:
+        return User(**self.extra['author'], _gate_=self.gate, _lazy_loaded_=True)
+
+    def _make_ctx(self) -> Context:
+        return Context(channel=self.channel, _gate_=self.gate)
+
+    def _make_quote(self) -> Optional[PrivateQuotedMessage]:
+        if 'quote' not in self.extra:
+            return None
+        return PrivateQuotedMessage(**self.extra['quote'], _gate_=self.gate, _lazy_loaded_=True)
 
     @property
     def chat_code(self) -> str:
@@ -321,6 +382,8 @@ class PrivateMessage(Message):
     @property
     def channel(self) -> PrivateChannel:
         """the message's channel"""
+        if self._channel is None:
+            self._channel = PrivateChannel(code=self.extra['code'], target_info=self.extra['author'], _gate_=self.gate)
         return self._channel
 
     @property
@@ -330,7 +393,7 @@ class PrivateMessage(Message):
 
         If the quote does not exist, it will return None
         """
-        return self._quote
+        return super().quote
 
     async def add_reaction(self, emoji: str):
         return await self.gate.exec_req(api.DirectMessage.addReaction(msg_id=self.id, emoji=emoji))
@@ -341,7 +404,7 @@ class PrivateMessage(Message):
 
     async def update(self, content: Union[str, List], quote: str = None, _: str = None):
         if isinstance(content, List):
-            content = json.dumps(content)
+            content = dumps(content)
         params = {'msg_id': self.id, 'content': content}
         if quote is not None:
             params['quote'] = quote
@@ -350,6 +413,7 @@ class PrivateMessage(Message):
 
 class Event(RawMessage):
     """sent by system, opposites to Message, carries various types of payload"""
+    __slots__ = ()
 
     @property
     def event_type(self) -> EventTypes:
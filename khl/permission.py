@@ -12,6 +12,7 @@ class RolePermission:
     """part of channel permission, the permission setting for a specific role in the channel
 
     this setting overwrites the role's permission set in the guild"""
+    __slots__ = ('role_id', 'allow', 'deny')
     role_id: int
     allow: int
     deny: int
@@ -24,6 +25,7 @@ class RolePermission:
 
 class UserPermission:
     """part of channel permission, the permission setting for a specific user"""
+    __slots__ = ('user', 'allow', 'deny')
     user: User
     allow: int
     deny: int
@@ -41,6 +43,7 @@ class ChannelPermission(LazyLoadable, Requestable):
     1. customized role permission: overwrites the role's global permission settings
     2. customized user permission: exclusively set a user's permission in the channel
     """
+    __slots__ = ('_id', '_sync', 'roles', 'users', '_loaded', 'gate')
     _id: str  # bound channel id
     _sync: int
 
@@ -64,6 +67,7 @@ class ChannelPermission(LazyLoadable, Requestable):
     def __init__(self, **kwargs):
         self._id: str = kwargs.get('id')
         self.gate = kwargs.get('_gate_')
+        self._loaded = False
         self._load_fields(**kwargs)
 
     def _load_fields(self, **kwargs):
@@ -79,6 +83,7 @@ class ChannelPermission(LazyLoadable, Requestable):
 
 class PermissionHolder(LazyLoadable, Requestable, ABC):
     """holder of the permissions, can be a channel or a category"""
+    __slots__ = ()
 
     permission: ChannelPermission
 
@@ -1,28 +1,67 @@
 import asyncio
+import heapq
 import logging
-from typing import Dict
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 log = logging.getLogger(__name__)
 
 
+class Priorities(IntEnum):
+    """
+    priority classes of requests, used by PriorityRateLimiter to share a throttled bucket
+    """
+    INTERACTIVE = 0
+    """
+    user-visible actions, e.g. replying to a msg
+    """
+    MODERATION = 1
+    """
+    management actions, e.g. kicking out a user, granting a role
+    """
+    BACKGROUND = 2
+    """
+    bulk jobs, e.g. syncing the member list, the default of paged requests
+    """
+
+
 class RateLimiter:
-    """rate limit control
+    """rate limit control, a token bucket per rate limit bucket, synced from the ``X-Rate-Limit-*`` headers
+
+    each request reserves its own time slot in the bucket, thus concurrent waiters are spread evenly over the window,
+    rather than waking up together
+
+    no lock is needed: a reservation is a single store operation, buckets are independent with each other
+
+    bucket states are kept in the ``store``, in the process in default,
+    workers sharing one bot token should share a store as well, e.g. ``SQLiteRateLimitStore``
     @param start: when the remain reach this number, start ratelimit
     """
 
-    def __init__(self, start: int = 120):
-        self._ratelimit_info: Dict[str, RateLimiter.RateLimitData] = {}
+    def __init__(self, start: int = 120, *, store: 'RateLimitStore' = None):
+        self._store = store if store is not None else MemoryRateLimitStore()
         self._api_bucket_mapping: Dict[str, str] = {}
-        self._lock = asyncio.Lock()
         self._start = start
 
-    async def wait_for_rate(self, route):
-        """get and wait delay"""
+    @property
+    def store(self) -> 'RateLimitStore':
+        """where the bucket states are kept"""
+        return self._store
+
+    async def wait_for_rate(self, route, priority: Optional[Priorities] = None):  # pylint: disable=unused-argument
+        """reserve a slot and wait until it, slots are reserved in arrival order, ``priority`` is ignored"""
 
         bucket = await self.get_bucket(route)
-        delay = await self.get_delay(bucket)
+        delay = await self.reserve(bucket)
         log.debug(f'ratelimiter: {route} req bucket: {bucket} delay: {delay: .3f}s')
-        await asyncio.sleep(delay)
+        if delay > 0:
+            await asyncio.sleep(delay)
 
     async def update(self, route, headers):
         """get values and update ratelimit information"""
@@ -30,7 +69,7 @@ class RateLimiter:
         if 'X-Rate-Limit-Limit' in headers:
             bucket, remaining, reset = self.extract_xrate_header(headers)
             await self.push_api_bucket_mapping(route, bucket)
-            await self.update_ratelimit(bucket, remaining, reset)
+            await self.update_ratelimit(bucket, remaining, reset, int(headers['X-Rate-Limit-Limit']))
             log.debug(f'ratelimiter: {route} rsp ratelimit: bucket: {bucket} remaining: {remaining} reset: {reset}s')
 
     async def push_api_bucket_mapping(self, api: str, bucket: str):
@@ -39,55 +78,28 @@ class RateLimiter:
         to avoid that bucket and api router are not the same
         """
 
-        api = api.lower()
-        bucket = bucket.lower()
-
-        async with self._lock:
-            if api not in self._api_bucket_mapping:
-                self._api_bucket_mapping[api] = bucket
+        self._api_bucket_mapping.setdefault(api.lower(), bucket.lower())
 
     async def get_bucket(self, api: str):
         """get bucket name by api route"""
 
         api = api.lower()
+        return self._api_bucket_mapping.get(api, api)
 
-        async with self._lock:
-            if api not in self._api_bucket_mapping:
-                return api
-
-        return self._api_bucket_mapping[api]
-
-    async def update_ratelimit(self, bucket: str, remaining: int, reset: int):
+    async def update_ratelimit(self, bucket: str, remaining: int, reset: int, limit: int = None):
         """update rate limit info"""
 
-        bucket = bucket.lower()
-        async with self._lock:
-            if bucket not in self._ratelimit_info:
-                self._ratelimit_info[bucket] = self.RateLimitData(remaining, reset)
-            else:
-                self._ratelimit_info[bucket].remaining = remaining
-                self._ratelimit_info[bucket].reset = reset
+        await self._store.sync(bucket.lower(), remaining, reset, limit)
 
     async def get_delay(self, bucket: str) -> float:
-        """get request delay time, seconds"""
+        """get request delay time, seconds, without reserving a slot"""
 
-        bucket = bucket.lower()
-        async with self._lock:
-            if bucket not in self._ratelimit_info:
-                return 0
+        return await self._store.peek(bucket.lower(), self._start)
 
-            if self._ratelimit_info[bucket].reset == 0:
-                return 0
-
-            if self._ratelimit_info[bucket].remaining == 0:
-                return self._ratelimit_info[bucket].reset
-
-            if self._ratelimit_info[bucket].remaining > self._start:
-                return 0
-
-            delay = self._ratelimit_info[bucket].reset / self._ratelimit_info[bucket].remaining
+    async def reserve(self, bucket: str) -> float:
+        """reserve a slot in the bucket, return the delay until the slot, seconds"""
 
-        return delay
+        return await self._store.reserve(bucket.lower(), self._start)
 
     @staticmethod
     def extract_xrate_header(headers):
@@ -99,8 +111,360 @@ class RateLimiter:
         return bucket, remaining, reset
 
     class RateLimitData:
-        """to save single bucket rate limit"""
+        """to save single bucket rate limit, as a token bucket
 
-        def __init__(self, remaining: int = 120, reset: int = 0):
+        ``remaining`` tokens are left until ``reset_at``, then the bucket is refilled to ``limit``,
+        a negative ``remaining`` means slots reserved from the next window
+
+        ``now`` of methods is a timestamp from ``clock``, ``time.monotonic()`` in default"""
+        __slots__ = ('remaining', 'limit', 'window', 'reset_at', 'next_at')
+        clock = staticmethod(time.monotonic)
+
+        def __init__(self, remaining: int = 120, reset: int = 0, limit: int = None, now: float = None):
+            now = self.clock() if now is None else now
             self.remaining = remaining
-            self.reset = reset
+            self.limit = limit if limit is not None else remaining
+            self.window = reset  # length of a window, learned from the max reset seen
+            self.reset_at = now + reset
+            self.next_at = now  # the earliest slot not reserved yet
+
+        @property
+        def reset(self) -> float:
+            """seconds until the bucket refilled"""
+            return max(0.0, self.reset_at - self.clock())
+
+        def dump(self) -> Tuple[int, int, float, float, float]:
+            """state as a tuple, to be saved by stores"""
+            return self.remaining, self.limit, self.window, self.reset_at, self.next_at
+
+        @classmethod
+        def restore(cls, state: Sequence) -> 'RateLimiter.RateLimitData':
+            """construct from the state dumped"""
+            data = cls.__new__(cls)
+            data.remaining, data.limit, data.window, data.reset_at, data.next_at = state
+            return data
+
+        def sync(self, remaining: int, reset: int, limit: int = None, now: float = None):
+            """sync with the server's view"""
+            reset_at = (self.clock() if now is None else now) + reset
+            if reset_at > self.reset_at + 1:  # a new window, reset is in whole seconds, allow rounding error
+                self.remaining = remaining
+            else:  # the same window, local reservations may not reach the server yet
+                self.remaining = min(self.remaining, remaining)
+            self.reset_at = reset_at
+            self.window = max(self.window, reset)
+            if limit is not None:
+                self.limit = limit
+
+        def _refill(self, now: float):
+            if now < self.reset_at or self.window <= 0:
+                return
+            # the window passed: refilled by the server, slots reserved from the new window are taken
+            self.reset_at += ((now - self.reset_at) // self.window + 1) * self.window
+            self.remaining = self.limit + min(self.remaining, 0)
+
+        def _slot(self, now: float, start: int) -> float:
+            """time of the next free slot"""
+            self._refill(now)
+            if self.remaining > start:
+                return now
+            if self.remaining <= 0:
+                return max(now, self.next_at, self._debt_slot())
+            return max(now, self.next_at)
+
+        def _debt_slot(self) -> float:
+            """slot of the next reservation beyond the current window
+
+            the i-th one goes to the (i // limit)-th window after reset_at, spaced window/limit apart in it,
+            thus each future window is reserved up to limit, and waiters don't wake up together"""
+            if self.window <= 0 or self.limit <= 0:
+                return self.reset_at
+            debt = -self.remaining
+            return self.reset_at + (debt // self.limit) * self.window + (debt % self.limit) * self.window / self.limit
+
+        def peek(self, now: float, start: int) -> float:
+            """delay of the next slot, without reserving it"""
+            return self._slot(now, start) - now
+
+        def reserve(self, now: float, start: int) -> float:
+            """reserve the next slot, return the delay until it"""
+            slot = self._slot(now, start)
+            if 0 < self.remaining <= start:
+                # spread the rest tokens evenly over the rest of the window
+                self.next_at = slot + max(0.0, self.reset_at - slot) / self.remaining
+            elif self.remaining <= 0:
+                self.next_at = slot + (self.window / self.limit if self.window > 0 and self.limit > 0 else 0)
+            self.remaining -= 1
+            return slot - now
+
+
+class PriorityRateLimiter(RateLimiter):
+    """rate limiter schedules requests by priority, when a bucket is throttled
+
+    requests waiting for the same bucket are queued, each free slot goes to the request picked by weighted fair
+    queuing: with all classes waiting, a class gets slots in proportion to its weight, but no class is starved
+
+    when the bucket is not throttled and no one is waiting, requests go without queuing, the same as RateLimiter
+    """
+    DEFAULT_WEIGHTS = {Priorities.INTERACTIVE: 16, Priorities.MODERATION: 4, Priorities.BACKGROUND: 1}
+
+    def __init__(self,
+                 start: int = 120,
+                 *,
+                 store: 'RateLimitStore' = None,
+                 weights: Dict[Priorities, float] = None,
+                 default_priority: Priorities = Priorities.INTERACTIVE):
+        """
+        :param weights: share of slots of each priority class, ``DEFAULT_WEIGHTS`` in default
+        :param default_priority: priority of requests not tagged
+        """
+        super().__init__(start, store=store)
+        self.weights = {**self.DEFAULT_WEIGHTS, **(weights or {})}
+        self.default_priority = default_priority
+        self._queues: Dict[str, PriorityRateLimiter._FairQueue] = {}
+        self._pumps: Dict[str, asyncio.Future] = {}
+
+    async def wait_for_rate(self, route, priority: Optional[Priorities] = None):
+        """wait until a slot is granted to this request"""
+
+        bucket = await self.get_bucket(route)
+        queue = self._queues.get(bucket)
+        if (queue is None or not queue) and await self.get_delay(bucket) <= 0:
+            # fast path: free slot and no one waiting. the slot may be taken by others sharing the store after peeking,
+            # thus wait for the one actually reserved
+            delay = await self.reserve(bucket)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            return
+
+        priority = self.default_priority if priority is None else priority
+        if queue is None:
+            queue = self._queues[bucket] = self._FairQueue()
+        waiter = asyncio.get_event_loop().create_future()
+        queue.push(waiter, priority, self.weights[priority])
+        if bucket not in self._pumps:
+            self._pumps[bucket] = asyncio.ensure_future(self._pump(bucket, queue))
+        log.debug(f'ratelimiter: {route} req bucket: {bucket} queued as {priority.name}, waiting: {len(queue)}')
+        await waiter
+
+    async def _pump(self, bucket: str, queue: 'PriorityRateLimiter._FairQueue'):
+        """grant slots of the bucket to waiters one by one"""
+        try:
+            while queue:
+                delay = await self.get_delay(bucket)
+                if delay > 0:  # waiters arriving during the sleep compete for the slot as well
+                    await asyncio.sleep(delay)
+                    continue
+                waiter = queue.pop()
+                if waiter is None:
+                    break
+                delay = await self.reserve(bucket)
+                if delay > 0:  # taken by others sharing the store after peeking, the waiter keeps the reserved slot
+                    await asyncio.sleep(delay)
+                if not waiter.done():
+                    waiter.set_result(None)
+        finally:
+            self._pumps.pop(bucket, None)
+            if not queue:
+                self._queues.pop(bucket, None)
+
+    class _FairQueue:
+        """waiters of a bucket, ordered by weighted fair queuing finish tags"""
+        __slots__ = ('_heap', '_vtime', '_last_finish', '_seq')
+        _heap: List[Tuple[float, int, asyncio.Future]]
+
+        def __init__(self):
+            self._heap = []
+            self._vtime = 0.0  # finish tag of the last granted waiter
+            self._last_finish: Dict[Priorities, float] = {}
+            self._seq = 0
+
+        def push(self, waiter: asyncio.Future, priority: Priorities, weight: float):
+            """queue the waiter, its finish tag is one slot after the previous one of the same class"""
+            finish = max(self._vtime, self._last_finish.get(priority, 0.0)) + 1 / weight
+            self._last_finish[priority] = finish
+            heapq.heappush(self._heap, (finish, self._seq, waiter))
+            self._seq += 1
+
+        def pop(self) -> Optional[asyncio.Future]:
+            """the waiter with the smallest finish tag, skips the cancelled"""
+            while self._heap:
+                finish, _, waiter = heapq.heappop(self._heap)
+                if not waiter.done():
+                    self._vtime = finish
+                    return waiter
+            return None
+
+        def __len__(self):
+            return sum(1 for _, _, w in self._heap if not w.done())
+
+        def __bool__(self):
+            while self._heap and self._heap[0][2].done():  # drop cancelled waiters on the top
+                heapq.heappop(self._heap)
+            return bool(self._heap)
+
+
+class RateLimitStore(ABC):
+    """
+    where RateLimiter keeps bucket states
+
+    each operation on a bucket should be atomic, thus rate limiters sharing a store share tokens and reservations
+    """
+
+    @abstractmethod
+    async def sync(self, bucket: str, remaining: int, reset: int, limit: int = None):
+        """sync the bucket with the server's view, create it if not exist"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def peek(self, bucket: str, start: int) -> float:
+        """delay of the next slot of the bucket, seconds, 0 if the bucket not exist"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def reserve(self, bucket: str, start: int) -> float:
+        """reserve the next slot of the bucket, return the delay until it, seconds, 0 if the bucket not exist"""
+        raise NotImplementedError
+
+    def close(self):
+        """release resources held by the store"""
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """keeps bucket states in the process, the default store
+
+    operations have no await inside, thus atomic in the event loop"""
+    _buckets: Dict[str, RateLimiter.RateLimitData]
+
+    def __init__(self):
+        self._buckets = {}
+
+    async def sync(self, bucket: str, remaining: int, reset: int, limit: int = None):
+        data = self._buckets.get(bucket)
+        if data is None:
+            self._buckets[bucket] = RateLimiter.RateLimitData(remaining, reset, limit)
+        else:
+            data.sync(remaining, reset, limit)
+
+    async def peek(self, bucket: str, start: int) -> float:
+        data = self._buckets.get(bucket)
+        return 0 if data is None else data.peek(data.clock(), start)
+
+    async def reserve(self, bucket: str, start: int) -> float:
+        data = self._buckets.get(bucket)
+        return 0 if data is None else data.reserve(data.clock(), start)
+
+
+class _WallClockRateLimitData(RateLimiter.RateLimitData):
+    """timed by the wall clock, which all processes agree with"""
+    __slots__ = ()
+    clock = staticmethod(time.time)
+
+
+class SQLiteRateLimitStore(RateLimitStore):
+    """
+    keeps bucket states in a sqlite database in WAL mode, shared by processes on the same host,
+    e.g. workers running with the same bot token
+
+    each write is a short ``BEGIN IMMEDIATE`` transaction, which serializes reservations among processes,
+    slots are timed by the wall clock
+
+    sqlite calls are blocking, they are run in a dedicated thread, thus waiting for the lock held by other processes
+    never stalls the event loop
+
+    the database file should be on a local disk, sqlite locking is unreliable on network file systems
+    """
+    _SCHEMA = 'CREATE TABLE IF NOT EXISTS ratelimit_buckets (bucket TEXT PRIMARY KEY, remaining INTEGER NOT NULL, ' \
+              '"limit" INTEGER NOT NULL, window REAL NOT NULL, reset_at REAL NOT NULL, next_at REAL NOT NULL)'
+    path: str
+    timeout: float
+    _conn: Optional[sqlite3.Connection]
+    _executor: Optional[ThreadPoolExecutor]
+    _pid: Optional[int]
+
+    def __init__(self, path: str, *, timeout: float = 5.0):
+        """
+        :param path: the database file, created if not exist
+        :param timeout: seconds, max time to wait for the lock held by other processes
+        """
+        self.path = path
+        self.timeout = timeout
+        self._conn = None
+        self._executor = None
+        self._pid = None
+
+    def _run(self, func, *args) -> 'asyncio.Future':
+        if self._executor is None or self._pid != os.getpid():  # neither the thread nor the connection survives fork
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='khl-ratelimit')
+            self._conn = None
+            self._pid = os.getpid()
+        return asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(self._SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    @staticmethod
+    def _load(conn: sqlite3.Connection, bucket: str) -> Optional[_WallClockRateLimitData]:
+        row = conn.execute('SELECT remaining, "limit", window, reset_at, next_at FROM ratelimit_buckets '
+                           'WHERE bucket = ?', (bucket,)).fetchone()
+        return None if row is None else _WallClockRateLimitData.restore(row)
+
+    @staticmethod
+    def _save(conn: sqlite3.Connection, bucket: str, data: _WallClockRateLimitData):
+        conn.execute('INSERT OR REPLACE INTO ratelimit_buckets VALUES (?, ?, ?, ?, ?, ?)', (bucket,) + data.dump())
+
+    def _sync(self, bucket: str, remaining: int, reset: int, limit: Optional[int]):
+        with self._transaction() as conn:
+            data = self._load(conn, bucket)
+            if data is None:
+                data = _WallClockRateLimitData(remaining, reset, limit)
+            else:
+                data.sync(remaining, reset, limit)
+            self._save(conn, bucket, data)
+
+    def _peek(self, bucket: str, start: int) -> float:
+        data = self._load(self._connection(), bucket)
+        return 0 if data is None else data.peek(data.clock(), start)
+
+    def _reserve(self, bucket: str, start: int) -> float:
+        with self._transaction() as conn:
+            data = self._load(conn, bucket)
+            if data is None:
+                return 0
+            delay = data.reserve(data.clock(), start)
+            self._save(conn, bucket, data)
+        return delay
+
+    async def sync(self, bucket: str, remaining: int, reset: int, limit: int = None):
+        await self._run(self._sync, bucket, remaining, reset, limit)
+
+    async def peek(self, bucket: str, start: int) -> float:
+        return await self._run(self._peek, bucket, start)
+
+    async def reserve(self, bucket: str, start: int) -> float:
+        return await self._run(self._reserve, bucket, start)
+
+    def close(self):
+        if self._executor is not None and self._pid == os.getpid():
+            if self._conn is not None:
+                self._executor.submit(self._conn.close)
+            self._executor.shutdown(wait=True)
+        self._conn = None
+        self._executor = None
@@ -3,11 +3,13 @@ import logging
 import time
 import zlib
 from abc import ABC, abstractmethod
-from typing import Dict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
 
 from aiohttp import ClientWebSocketResponse, ClientSession, web, WSMessage
 
 from .cert import Cert
+from .codec import dumps, loads
 from .interface import AsyncRunnable
 
 log = logging.getLogger(__name__)
@@ -15,6 +17,11 @@ log = logging.getLogger(__name__)
 API = 'https://www.kaiheila.cn/api/v3'
 
 
+def _decode_pkg(cert: Cert, data: bytes, compress: bool) -> Dict:
+    """decompress, decrypt and parse a pkg, at module level thus can be run in a process pool"""
+    return cert.decode_raw(zlib.decompress(data) if compress else data)
+
+
 class Receiver(AsyncRunnable, ABC):
     """
     1. receive raw data from khl server
@@ -44,28 +51,59 @@ class Receiver(AsyncRunnable, ABC):
 
 
 class WebsocketReceiver(Receiver):
-    """receive data in websocket mode"""
+    """receive data in websocket mode
+
+    sessions are resumed after reconnecting, events missed in between are resent by khl server,
+    events are delivered in ``sn`` order without duplicates:
 
-    def __init__(self, cert: Cert, compress: bool):
+    - events arrived early are held in a reorder buffer until the gap filled, or skipped after ``reorder_timeout``
+    - events with ``sn`` already delivered are dropped
+    """
+    RESUME_FAILED_CODES = (40106, 40107, 40108)  # resume failed, session expired, invalid sn
+    SN_RESTART_GAP = 10000  # sn going back this much is taken as a restarted sequence, rather than duplicates
+    MAX_RESUME_FAILURES = 3
+    RECONNECT_BASE_DELAY = 2  # seconds, doubled after each failed attempt
+    RECONNECT_MAX_DELAY = 60
+
+    def __init__(self, cert: Cert, compress: bool, *, reorder_timeout: float = 6, reorder_size: int = 100):
+        """
+        :param reorder_timeout: seconds to wait for a missing sn, events after it are delivered then
+        :param reorder_size: max count of events held for a missing sn, events after it are delivered if exceeded
+        """
         super().__init__()
         self._cert = cert
         self.compress = compress
+        self.reorder_timeout = reorder_timeout
+        self.reorder_size = reorder_size
 
         self._NEWEST_SN = 0
         self._RAW_GATEWAY = ''
+        self._session_id = ''
+        self._resume_failures = 0
+        self._reconnect_attempts = 0  # since the last successful hello
+        self._reorder: Dict[int, Dict] = {}
+        self._gap_timer: Optional[asyncio.Future] = None
+        self._deliver_lock: Optional[asyncio.Lock] = None
 
     @property
     def type(self) -> str:
         return 'websocket'
 
+    @property
+    def session_id(self) -> str:
+        """id of the current session, empty if not connected yet or the session is dropped"""
+        return self._session_id
+
     async def heartbeat(self, ws_conn: ClientWebSocketResponse):
         """khl customized heartbeat scheme"""
         while True:
             try:
                 await asyncio.sleep(26)
-                await ws_conn.send_json({'s': 2, 'sn': self._NEWEST_SN})
+                await ws_conn.send_json({'s': 2, 'sn': self._NEWEST_SN}, dumps=dumps)
             except ConnectionResetError:
                 return
+            except asyncio.CancelledError:  # the connection is closed
+                return
             except Exception as e:
                 log.exception('error raised during websocket heartbeat',
                               exc_info=e)
@@ -79,51 +117,193 @@ class WebsocketReceiver(Receiver):
         async with cs.get(f"{API}/gateway/index",
                           headers=headers,
                           params=params) as res:
-            res_json = await res.json()
+            res_json = await res.json(loads=loads)
             if res_json['code'] != 0:
                 log.error(f'getting gateway: {res_json}')
                 return
 
             self._RAW_GATEWAY = res_json['data']['url']
 
-    async def _connect_gateway_and_handle_msg(self, cs: ClientSession):
-        async with cs.ws_connect(self._RAW_GATEWAY) as ws_conn:
-            asyncio.ensure_future(self.heartbeat(ws_conn), loop=self.loop)
+    def _gateway_url(self) -> str:
+        if not self._session_id:
+            return self._RAW_GATEWAY
+        return f'{self._RAW_GATEWAY}&resume=1&sn={self._NEWEST_SN}&session_id={self._session_id}'
 
-            log.info('[ init ] launched')
-            try:
-                async for raw in ws_conn:
-                    raw: WSMessage
-                    await self._handle_raw(raw)
-            except Exception:
-                log.exception(
-                    'error raised during websocket receive, reconnect automatically'
-                )
+    def _reset_session(self):
+        """drop the session, the next connection starts a new one with a new gateway"""
+        self._session_id = ''
+        self._resume_failures = 0
+        self._RAW_GATEWAY = ''
+        self._NEWEST_SN = 0
+        self._reorder.clear()
+        if self._gap_timer is not None:
+            self._gap_timer.cancel()
+            self._gap_timer = None
+
+    async def _connect_gateway_and_handle_msg(self, cs: ClientSession):
+        resuming = bool(self._session_id)
+        try:
+            async with cs.ws_connect(self._gateway_url()) as ws_conn:
+                heartbeat = asyncio.ensure_future(self.heartbeat(ws_conn), loop=self.loop)
+
+                log.info(f'[ init ] launched{", resuming session " + self._session_id if resuming else ""}')
+                try:
+                    async for raw in ws_conn:
+                        raw: WSMessage
+                        if not await self._handle_raw(raw):
+                            break
+                finally:
+                    heartbeat.cancel()
+        except Exception:
+            log.exception(
+                'error raised during websocket receive, reconnect automatically'
+            )
+            if resuming:
+                self._resume_failures += 1
+                if self._resume_failures >= self.MAX_RESUME_FAILURES:
+                    log.warning('failed to resume the session too many times, start a new session')
+                    self._reset_session()
+        if not self._session_id:
+            # nothing to resume, e.g. the handshake failed or the hello never came: the gateway may be dead or
+            # refuse the token, fetch a new one as a new session
+            self._RAW_GATEWAY = ''
+
+    async def _backoff(self):
+        """wait before reconnecting, exponentially longer after each failed attempt, no wait after a healthy session"""
+        if self._reconnect_attempts:
+            delay = min(self.RECONNECT_BASE_DELAY * 2 ** (self._reconnect_attempts - 1), self.RECONNECT_MAX_DELAY)
+            log.info(f'reconnect in {delay}s, attempt: {self._reconnect_attempts}')
+            await asyncio.sleep(delay)
+        self._reconnect_attempts += 1
 
     async def start(self):
+        self._deliver_lock = asyncio.Lock()
         async with ClientSession(loop=self.loop) as cs:
             while True:
-                await self._get_gateway(cs)
+                await self._backoff()
+                if not self._RAW_GATEWAY:
+                    try:
+                        await self._get_gateway(cs)
+                    except Exception:
+                        log.exception('error raised during getting gateway')
+                    if not self._RAW_GATEWAY:
+                        continue
                 await self._connect_gateway_and_handle_msg(cs)
 
-    async def _handle_raw(self, raw: WSMessage):
+    async def _handle_raw(self, raw: WSMessage) -> bool:
+        """:return: if the connection should be kept"""
         try:
             data = raw.data
             data = zlib.decompress(data) if self.compress else data
             pkg: Dict = self._cert.decode_raw(data)
-            log.debug(f'upcoming raw: {pkg}')
-            if pkg['s'] != 0:
-                return
-            self._NEWEST_SN = pkg['sn']
-            await self.pkg_queue.put(pkg['d'])
+            log.debug('upcoming raw: %s', pkg)  # lazy: formatting a whole pkg costs more than inflating it
+            signal = pkg['s']
+            if signal == 0:
+                await self._on_event(pkg)
+            elif signal == 1:
+                return self._on_hello(pkg['d'])
+            elif signal == 5:
+                log.warning(f'reconnect required by khl server: {pkg["d"]}, start a new session')
+                self._reset_session()
+                return False
+            elif signal == 6:
+                self._session_id = pkg['d'].get('session_id', self._session_id)
+                log.info(f'session resumed: {self._session_id}, sn: {self._NEWEST_SN}')
         except Exception as e:
             log.exception(e)
+        return True
+
+    def _on_hello(self, d: Dict) -> bool:
+        code = d.get('code', 0)
+        if code == 0:
+            self._session_id = d.get('session_id', self._session_id)
+            self._resume_failures = 0
+            self._reconnect_attempts = 0
+            return True
+        log.error(f'hello failed: {d}')
+        if code in self.RESUME_FAILED_CODES:
+            self._reset_session()
+        else:  # e.g. token expired, the gateway url carries the token, get a new one
+            self._RAW_GATEWAY = ''
+        return False
+
+    async def _on_event(self, pkg: Dict):
+        sn = pkg.get('sn')
+        if sn is None or self._NEWEST_SN == 0 or self._NEWEST_SN - sn >= self.SN_RESTART_GAP:
+            self._reorder.clear()
+            await self._deliver([(sn, pkg['d'])])
+            return
+        if sn <= self._NEWEST_SN or sn in self._reorder:
+            log.debug(f'dropped duplicated event, sn: {sn}')
+            return
+        self._reorder[sn] = pkg['d']
+        if sn != self._NEWEST_SN + 1:
+            log.debug(f'event arrived early, sn: {sn}, expecting: {self._NEWEST_SN + 1}')
+            if len(self._reorder) > self.reorder_size:
+                await self._skip_gap()
+            elif self._gap_timer is None:
+                self._gap_timer = asyncio.ensure_future(self._gap_timeout())
+            return
+        await self._deliver(self._take_ready())
+
+    def _take_ready(self) -> List[Tuple[int, Dict]]:
+        """pop events from the reorder buffer, which are contiguous to the newest sn"""
+        ready = []
+        sn = self._NEWEST_SN + 1
+        while sn in self._reorder:
+            ready.append((sn, self._reorder.pop(sn)))
+            sn += 1
+        if not self._reorder and self._gap_timer is not None:
+            self._gap_timer.cancel()
+            self._gap_timer = None
+        return ready
+
+    async def _skip_gap(self):
+        """give up the missing sn, deliver events after the first gap"""
+        first = min(self._reorder)
+        log.warning(f'events missing, sn: {self._NEWEST_SN + 1}-{first - 1}, skipped')
+        self._NEWEST_SN = first - 1
+        await self._deliver(self._take_ready())
+
+    async def _gap_timeout(self):
+        await asyncio.sleep(self.reorder_timeout)
+        self._gap_timer = None
+        if self._reorder:
+            await self._skip_gap()
+        if self._reorder and self._gap_timer is None:  # another gap behind
+            self._gap_timer = asyncio.ensure_future(self._gap_timeout())
+
+    async def _deliver(self, events: List[Tuple[int, Dict]]):
+        if not events:
+            return
+        if events[-1][0] is not None:
+            self._NEWEST_SN = events[-1][0]
+        async with self._deliver_lock:  # pkg_queue.put() may block, keep the order among concurrent deliveries
+            for _, d in events:
+                await self.pkg_queue.put(d)
 
 
 class WebhookReceiver(Receiver):
-    """receive data in webhook mode"""
+    """receive data in webhook mode
 
-    def __init__(self, cert: Cert, *, port: int, route: str, compress: bool):
+    pkgs can be decoded in an executor rather than on the event loop, thus decrypting large pkgs won't block handlers
+    and other requests: a thread pool keeps the loop responsive, a process pool decodes in parallel but costs
+    pickling the data and the cert per pkg
+    """
+
+    def __init__(self,
+                 cert: Cert,
+                 *,
+                 port: int,
+                 route: str,
+                 compress: bool,
+                 decode_executor: Union[str, Executor, None] = None,
+                 decode_window: int = 64):
+        """
+        :param decode_executor: where to decompress, decrypt and parse pkgs: ``'thread'`` for a thread pool,
+            ``'process'`` for a process pool, or an Executor owned by the caller. None means on the event loop
+        :param decode_window: max count of pkgs being decoded in the executor, requests beyond it wait for a slot
+        """
         super().__init__()
         self._cert = cert
         self.port = port
@@ -131,6 +311,17 @@ class WebhookReceiver(Receiver):
         self.app = web.Application()
         self.compress = compress
         self.sn_dup_map = {}
+        if decode_executor == 'thread':
+            self._executor = ThreadPoolExecutor(thread_name_prefix='khl-decode')
+        elif decode_executor == 'process':
+            self._executor = ProcessPoolExecutor()
+        elif decode_executor is None or isinstance(decode_executor, Executor):
+            self._executor = decode_executor
+        else:
+            raise ValueError(f'unsupported decode_executor: {decode_executor}')
+        self._owns_executor = isinstance(decode_executor, str)
+        self.decode_window = decode_window
+        self._decode_slots: Optional[asyncio.Semaphore] = None  # created in start(), bound to the running loop
 
     @property
     def type(self) -> str:
@@ -148,13 +339,19 @@ class WebhookReceiver(Receiver):
         self.sn_dup_map[sn] = current
         return False
 
+    async def _decode(self, data: bytes) -> Dict:
+        if self._executor is None:
+            return _decode_pkg(self._cert, data, self.compress)
+        async with self._decode_slots:
+            return await asyncio.get_event_loop().run_in_executor(self._executor, _decode_pkg, self._cert, data,
+                                                                  self.compress)
+
     async def start(self):
+        self._decode_slots = asyncio.Semaphore(self.decode_window)
 
         async def on_recv(request: web.Request):
             try:
-                data = await request.read()
-                data = zlib.decompress(data) if self.compress else data
-                pkg: Dict = self._cert.decode_raw(data)
+                pkg: Dict = await self._decode(await request.read())
             except Exception as e:
                 log.exception(e)
                 return web.Response()
@@ -173,7 +370,7 @@ class WebhookReceiver(Receiver):
                 pkg = pkg['d']
                 if pkg['type'] == 255 and pkg[
                         'channel_type'] == 'WEBHOOK_CHALLENGE':
-                    return web.json_response({'challenge': pkg['challenge']})
+                    return web.json_response({'challenge': pkg['challenge']}, dumps=dumps)
                 await self.pkg_queue.put(pkg)
 
             return web.Response()
@@ -188,5 +385,9 @@ class WebhookReceiver(Receiver):
 
         await site.start()
 
-        while True:
-            await asyncio.sleep(3600)  # sleep forever
+        try:
+            while True:
+                await asyncio.sleep(3600)  # sleep forever
+        finally:
+            if self._owns_executor:
+                self._executor.shutdown(wait=False)
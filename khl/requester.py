@@ -1,61 +1,268 @@
 import asyncio
+import copy
 import logging
-from typing import Union, List, Optional
+import time
+from collections import deque
+from typing import Union, List, Optional, AsyncIterator, Dict, Tuple, Callable, Awaitable
 
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 
-from .ratelimiter import RateLimiter
+from .ratelimiter import RateLimiter, Priorities
+from .retry import Retrier, RetryOutcomes, RetryRecord
 from .api import _Req
 from .cert import Cert
+from .codec import dumps, loads
 
 log = logging.getLogger(__name__)
 
 API = 'https://www.kookapp.cn/api/v3'
 
 
+class HTTPConfig:
+    """
+    connection pool and timeout settings of the ClientSession used by HTTPRequester
+
+    the defaults are the same as aiohttp's, except the DNS cache ttl
+    """
+    limit: int
+    limit_per_host: int
+    keepalive_timeout: float
+    ttl_dns_cache: Optional[int]
+    timeout_total: Optional[float]
+    timeout_connect: Optional[float]
+    timeout_sock_connect: Optional[float]
+    timeout_sock_read: Optional[float]
+
+    def __init__(self,
+                 *,
+                 limit: int = 100,
+                 limit_per_host: int = 0,
+                 keepalive_timeout: float = 15,
+                 ttl_dns_cache: Optional[int] = 300,
+                 timeout_total: Optional[float] = 300,
+                 timeout_connect: Optional[float] = None,
+                 timeout_sock_connect: Optional[float] = None,
+                 timeout_sock_read: Optional[float] = None):
+        """
+        :param limit: max count of connections in the pool, 0 means no limit
+        :param limit_per_host: max count of connections to the same endpoint, 0 means no limit
+        :param keepalive_timeout: seconds an idle connection is kept for reuse
+        :param ttl_dns_cache: seconds a resolved DNS entry is cached, None means cached forever
+        :param timeout_total: seconds of a whole request, including connection establishment and response reading
+        :param timeout_connect: seconds of acquiring a connection, including waiting for a free one in the pool
+        :param timeout_sock_connect: seconds of connecting to the server for a new connection
+        :param timeout_sock_read: seconds between two reads from the server
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.timeout_total = timeout_total
+        self.timeout_connect = timeout_connect
+        self.timeout_sock_connect = timeout_sock_connect
+        self.timeout_sock_read = timeout_sock_read
+
+    def make_connector(self) -> TCPConnector:
+        """build a connector with the pool settings, should be called in a running loop"""
+        return TCPConnector(limit=self.limit,
+                            limit_per_host=self.limit_per_host,
+                            keepalive_timeout=self.keepalive_timeout,
+                            ttl_dns_cache=self.ttl_dns_cache)
+
+    def make_timeout(self) -> ClientTimeout:
+        """build the timeout settings"""
+        return ClientTimeout(total=self.timeout_total,
+                             connect=self.timeout_connect,
+                             sock_connect=self.timeout_sock_connect,
+                             sock_read=self.timeout_sock_read)
+
+    def make_session(self) -> ClientSession:
+        """build a session with the settings, should be called in a running loop
+
+        the session can be shared by several HTTPRequesters, i.e. several bots in one process"""
+        return ClientSession(connector=self.make_connector(), timeout=self.make_timeout(), json_serialize=dumps)
+
+
 class HTTPRequester:
-    """wrap raw requests, handle boilerplate param filling works"""
+    """wrap raw requests, handle boilerplate param filling works
 
-    def __init__(self, cert: Cert, ratelimiter: Optional[RateLimiter]):
+    the session is created on ``start()`` or the first request, and closed on ``close()``,
+    Bot calls them on its startup/shutdown
+    """
+
+    def __init__(self,
+                 cert: Cert,
+                 ratelimiter: Optional[RateLimiter],
+                 *,
+                 page_concurrency: int = 4,
+                 coalesce_get: bool = True,
+                 config: HTTPConfig = None,
+                 session: ClientSession = None,
+                 retrier: Optional[Retrier] = None):
+        """
+        :param page_concurrency: default max count of pages fetched concurrently in ``exec_paged_req()``
+        :param coalesce_get: concurrent identical GET requests share one in-flight request,
+            each caller still gets its own copy of the response
+        :param config: settings of the session created by this requester, ignored if ``session`` is given
+        :param session: use an external session, e.g. shared among several bots,
+            it is not closed by this requester, the owner should close it
+        :param retrier: decides how failed requests are retried, ``Retrier()`` in default, refer to it for details
+        """
+        if page_concurrency <= 0:
+            raise ValueError('page_concurrency should be positive')
         self._cert = cert
-        self._cs: Union[ClientSession, None] = None
+        self._cs: Union[ClientSession, None] = session
+        self._owns_session = session is None
+        self._config = config or HTTPConfig()
         self._ratelimiter = ratelimiter
+        self.retrier = retrier or Retrier()
+        self.page_concurrency = page_concurrency
+        self.coalesce_get = coalesce_get
+        self._inflight: Dict[Tuple, List] = {}  # key -> [future of the shared request, count of callers]
+
+    async def start(self):
+        """create the session if not yet, called before the first request"""
+        if self._cs is None or (self._owns_session and self._cs.closed):
+            self._cs = self._config.make_session()
+            self._owns_session = True
+
+    async def close(self):
+        """close the session if it is created by this requester, a new one is created on the next request"""
+        if self._owns_session and self._cs is not None and not self._cs.closed:
+            await self._cs.close()
+        if self._owns_session:
+            self._cs = None
+
+    @property
+    def session(self) -> Optional[ClientSession]:
+        """the session in use, None if not started"""
+        return self._cs
 
     def __del__(self):
-        if self._cs is not None:
-            asyncio.get_event_loop().run_until_complete(self._cs.close())
+        if not self._owns_session or self._cs is None or self._cs.closed:
+            return
+        # can not await here: schedule the close if the loop is still alive, else leave it to aiohttp's warning
+        log.warning('HTTPRequester is not closed, please call `await close()` before dropping it')
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            return
+        if loop.is_running():
+            loop.create_task(self._cs.close())
+        elif not loop.is_closed():
+            loop.run_until_complete(self._cs.close())
+
+    async def request(self, method: str, route: str, *, priority: Priorities = None,
+                      **params) -> Union[dict, list, bytes]:
+        """wrap raw request, fill authorization, handle & extract response
+
+        identical concurrent GET requests are coalesced into one if ``coalesce_get``
+
+        :param priority: used by the ratelimiter to schedule requests in a throttled bucket, refer to Priorities"""
+        key = self._coalesce_key(method, route, params) if self.coalesce_get else None
+        if key is None:
+            return await self._request(method, route, priority, **params)
 
-    async def request(self, method: str, route: str, **params) -> Union[dict, list, bytes]:
-        """wrap raw request, fill authorization, handle & extract response"""
+        flight = self._inflight.get(key)
+        if flight is None:
+            flight = [asyncio.ensure_future(self._request_coalesced(key, method, route, priority, params)), 0]
+            self._inflight[key] = flight
+        else:
+            log.debug(f'{method} {route}: joined the in-flight request')
+        flight[1] += 1
+        # shield: one caller cancelled should not cancel the request shared with others
+        rsp = await asyncio.shield(flight[0])
+        # no caller can join after the request finished, thus the count is final here
+        return rsp if flight[1] == 1 else copy.deepcopy(rsp)
+
+    @staticmethod
+    def _coalesce_key(method: str, route: str, params: Dict) -> Optional[Tuple]:
+        """:return: key of identical requests, None if the request should not be coalesced"""
+        if method != 'GET' or not set(params).issubset({'params'}):  # e.g. custom headers
+            return None
+        query = params.get('params') or {}
+        return route, tuple(sorted((k, repr(v)) for k, v in query.items()))
+
+    async def _request_coalesced(self, key: Tuple, method: str, route: str, priority: Optional[Priorities],
+                                 params: Dict):
+        try:
+            return await self._request(method, route, priority, **params)
+        finally:
+            self._inflight.pop(key, None)  # before the future is done, thus no one joins a finished request
+
+    async def _request(self, method: str, route: str, priority: Optional[Priorities],
+                       **params) -> Union[dict, list, bytes]:
+        """send the request, retry on failure according to the retry policy of the route"""
+        policy = self.retrier.policy_of(method, route, params)
+        policy.prepare(params)
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                rsp = await self._send(method, route, priority, **params)
+            except Exception as e:
+                if not policy.is_retryable(e):
+                    self.retrier.emit(RetryRecord(method, route, attempt, RetryOutcomes.NOT_RETRYABLE, e))
+                    raise
+                delay = policy.next_delay(e, attempt, time.monotonic() - start)
+                if delay is None:
+                    self.retrier.emit(RetryRecord(method, route, attempt, RetryOutcomes.EXHAUSTED, e))
+                    raise
+                self.retrier.emit(RetryRecord(method, route, attempt, RetryOutcomes.RETRYING, e, delay))
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            if attempt > 0:
+                self.retrier.emit(RetryRecord(method, route, attempt, RetryOutcomes.RECOVERED))
+            return rsp
+
+    async def _send(self, method: str, route: str, priority: Optional[Priorities],
+                    **params) -> Union[dict, list, bytes]:
         headers = params.pop('headers', {})
         params['headers'] = headers
 
         log.debug(f'{method} {route}: req: {params}')  # token is excluded
 
         if self._ratelimiter is not None:
-            await self._ratelimiter.wait_for_rate(route)
+            await self._ratelimiter.wait_for_rate(route, priority)
 
         headers['Authorization'] = f'Bot {self._cert.token}'
-        if self._cs is None:  # lazy init
-            self._cs = ClientSession()
+        if self._cs is None or self._cs.closed:  # lazy init
+            await self.start()
         async with self._cs.request(method, f'{API}/{route}', **params) as res:
+            if self._ratelimiter is not None:
+                await self._ratelimiter.update(route, res.headers)
+
             if res.content_type == 'application/json':
-                rsp = await res.json()
+                rsp = loads(await res.read())
                 if rsp['code'] != 0:
-                    raise HTTPRequester.APIRequestFailed(method, route, params, rsp['code'], rsp['message'])
+                    raise HTTPRequester.APIRequestFailed(method, route, params, rsp['code'], rsp['message'],
+                                                         status=res.status, retry_after=self._retry_after(res))
                 rsp = rsp['data']
+            elif res.status >= 400:
+                raise HTTPRequester.APIRequestFailed(method, route, params, res.status, res.reason,
+                                                     status=res.status, retry_after=self._retry_after(res))
             else:
                 rsp = await res.read()
 
-            if self._ratelimiter is not None:
-                await self._ratelimiter.update(route, res.headers)
-
             log.debug(f'{method} {route}: rsp: {rsp}')
             return rsp
 
-    async def exec_req(self, r: _Req):
+    @staticmethod
+    def _retry_after(res) -> Optional[float]:
+        """seconds the server asks to wait before retrying, None if not told"""
+        try:
+            if 'Retry-After' in res.headers:
+                return float(res.headers['Retry-After'])
+            if res.status == 429 or res.headers.get('X-Rate-Limit-Remaining') == '0':
+                return float(res.headers['X-Rate-Limit-Reset'])
+        except (KeyError, ValueError):
+            pass
+        return None
+
+    async def exec_req(self, r: _Req, priority: Priorities = None):
         """_Req -> raw request"""
-        return await self.request(r.method, r.route, **r.params)
+        return await self.request(r.method, r.route, priority=priority, **r.params)
 
     async def exec_paged_req(self,
                              r: _Req,
@@ -63,42 +270,120 @@ class HTTPRequester:
                              begin_page: int = 1,
                              end_page: int = None,
                              page_size: int = 50,
-                             sort: str = '') -> List:
+                             sort: str = '',
+                             concurrency: int = None,
+                             priority: Priorities = Priorities.BACKGROUND) -> List:
         """
         execute paged requests
 
         iter from ``begin_page`` to the ``end_page``, ``end_page=None`` means to the end
 
-        1. get a req, inject the params
-        2. req and receive the result
-        3. unwrap the result, append result, fresh pagination params
+        1. req the first page, which tells the page total
+        2. req the rest pages concurrently, at most ``concurrency`` pages in flight
+        3. unwrap the results, concat them in page order
+
+        ``r`` is not modified, every page is requested with its own copy of params
 
         :param begin_page: int = 1,
         :param end_page: int = None,
         :param page_size: int = 50,
         :param sort: str = ''
+        :param concurrency: int = None, None means ``self.page_concurrency``, 1 means one by one
+        :param priority: Priorities = Priorities.BACKGROUND
         """
-        ret = []
-        current_page = begin_page
-        while end_page is None or current_page <= end_page:
-            r.params['params']['page'] = current_page
-            r.params['params']['page_size'] = page_size
-            if sort:
-                r.params['params']['sort'] = sort
-
-            p = await self.exec_req(r)
+        if end_page is not None and begin_page > end_page:
+            return []
+        concurrency = concurrency or self.page_concurrency
 
-            ret.extend(p['items'])
-            current_page = p['meta']['page']
-            page_total = p['meta']['page_total']
-            page_size = p['meta']['page_size']
+        p = await self.exec_req(self._page_req(r, begin_page, page_size, sort), priority)
+        ret = list(p['items'])
+        current_page = p['meta']['page']
+        page_size = p['meta']['page_size']
+        if end_page is None:
+            end_page = p['meta']['page_total']
 
-            current_page += 1
-            if end_page is None:
-                end_page = page_total
+        def req_page(page: int) -> Awaitable:
+            return self.exec_req(self._page_req(r, page, page_size, sort), priority)
 
+        for items in await self._fetch_pages(req_page, range(current_page + 1, end_page + 1), concurrency):
+            ret.extend(items)
         return ret
 
+    @staticmethod
+    async def _fetch_pages(req_page: Callable[[int], Awaitable], pages: range, concurrency: int) -> List[List]:
+        """fetch pages concurrently, :return: items of each page, in page order"""
+        sem = asyncio.Semaphore(concurrency)
+
+        async def fetch_page(page: int) -> List:
+            async with sem:
+                return (await req_page(page))['items']
+
+        tasks = [asyncio.ensure_future(fetch_page(page)) for page in pages]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:  # one page failed, the rest are useless
+                task.cancel()
+            raise
+
+    async def iter_paged_req(self,
+                             r: _Req,
+                             *,
+                             begin_page: int = 1,
+                             end_page: int = None,
+                             page_size: int = 50,
+                             sort: str = '',
+                             prefetch: int = 1,
+                             priority: Priorities = Priorities.BACKGROUND) -> AsyncIterator:
+        """
+        execute paged requests lazily, yield items page by page, thus only a few pages are held in memory
+
+        the same pagination args as ``exec_paged_req()``
+
+        :param prefetch: int = 1, count of pages requested ahead while the current page is being consumed,
+            0 means the next page is requested only after the current page consumed
+        :param priority: Priorities = Priorities.BACKGROUND
+        """
+        if end_page is not None and begin_page > end_page:
+            return
+        p = await self.exec_req(self._page_req(r, begin_page, page_size, sort), priority)
+        items = p['items']
+        next_page = p['meta']['page'] + 1
+        page_size = p['meta']['page_size']
+        if end_page is None:
+            end_page = p['meta']['page_total']
+
+        def req_page(page: int) -> Awaitable:
+            return self.exec_req(self._page_req(r, page, page_size, sort), priority)
+
+        pending = deque()
+        try:
+            while True:
+                while next_page <= end_page and len(pending) < prefetch:
+                    pending.append(asyncio.ensure_future(req_page(next_page)))
+                    next_page += 1
+                for item in items:
+                    yield item
+                if not pending:
+                    if next_page > end_page:
+                        return
+                    pending.append(asyncio.ensure_future(req_page(next_page)))
+                    next_page += 1
+                items = (await pending.popleft())['items']
+        finally:
+            for task in pending:  # consumer stopped early
+                task.cancel()
+
+    @staticmethod
+    def _page_req(r: _Req, page: int, page_size: int, sort: str) -> _Req:
+        """copy of ``r`` with pagination params injected"""
+        query = dict(r.params.get('params') or {})
+        query['page'] = page
+        query['page_size'] = page_size
+        if sort:
+            query['sort'] = sort
+        return _Req(r.method, r.route, {**r.params, 'params': query})
+
     class APIRequestFailed(Exception):
         """Raised when khl.py received non-zero error code from remote server.
 
@@ -108,13 +393,15 @@ class HTTPRequester:
         if request body is needed for debug purpose, consider explicitly catching this exception and
         call repr(...) with the exception instance."""
 
-        def __init__(self, method, route, params, err_code, err_message):
+        def __init__(self, method, route, params, err_code, err_message, *, status=None, retry_after=None):
             super().__init__()
             self.method = method
             self.route = route
             self.params = params
             self.err_code = err_code
             self.err_message = err_message
+            self.status = status  # http status
+            self.retry_after = retry_after  # seconds the server asks to wait before retrying
 
         def __str__(self):
             return f"Requesting '{self.method} {self.route}' failed with {self.err_code}: {self.err_message}"
@@ -0,0 +1,242 @@
+"""retry: decide whether and when a failed request is retried"""
+import asyncio
+import io
+import logging
+import random
+import uuid
+from enum import Enum
+from typing import Callable, Dict, Iterable, List, Optional
+
+from aiohttp import ClientConnectionError, ClientConnectorError, FormData
+
+log = logging.getLogger(__name__)
+
+
+class RetryOutcomes(Enum):
+    """
+    outcomes of a failed attempt, reported to the hooks of Retrier
+    """
+    RETRYING = 'retrying'
+    """
+    the attempt failed, will retry after a delay
+    """
+    RECOVERED = 'recovered'
+    """
+    the request succeeded after retries
+    """
+    EXHAUSTED = 'exhausted'
+    """
+    the attempt failed, but the retry count or time budget is used up, the error is raised
+    """
+    NOT_RETRYABLE = 'not_retryable'
+    """
+    the attempt failed with an error the policy does not retry, the error is raised
+    """
+
+
+class RetryRecord:
+    """what happened on an attempt, passed to the hooks"""
+    __slots__ = ('method', 'route', 'attempt', 'outcome', 'error', 'delay')
+    method: str
+    route: str
+    attempt: int  # 0 is the first try
+    outcome: RetryOutcomes
+    error: Optional[BaseException]
+    delay: float  # seconds before the next attempt, 0 if no next attempt
+
+    def __init__(self, method: str, route: str, attempt: int, outcome: RetryOutcomes,
+                 error: Optional[BaseException] = None, delay: float = 0.0):
+        self.method = method
+        self.route = route
+        self.attempt = attempt
+        self.outcome = outcome
+        self.error = error
+        self.delay = delay
+
+    def __repr__(self):
+        return f'RetryRecord({self.method} {self.route}, attempt={self.attempt}, outcome={self.outcome.value}, ' \
+               f'delay={self.delay:.3f}s, error={self.error!r})'
+
+
+class RetryMetrics:
+    """counters of a Retrier, for monitoring"""
+    retrying: int
+    recovered: int
+    exhausted: int
+    not_retryable: int
+    total_delay: float
+
+    def __init__(self):
+        self.retrying = 0
+        self.recovered = 0
+        self.exhausted = 0
+        self.not_retryable = 0
+        self.total_delay = 0.0
+
+    def record(self, record: RetryRecord):
+        """count the record in"""
+        setattr(self, record.outcome.value, getattr(self, record.outcome.value) + 1)
+        self.total_delay += record.delay
+
+    def __repr__(self):
+        return f'RetryMetrics(retrying={self.retrying}, recovered={self.recovered}, exhausted={self.exhausted}, ' \
+               f'not_retryable={self.not_retryable}, total_delay={self.total_delay:.3f}s)'
+
+
+class RetryPolicy:
+    """
+    how failed requests of a route class are retried: exponential backoff with full jitter,
+    the server's ``Retry-After``/``X-Rate-Limit-Reset`` is honored if longer
+
+    errors are retried if:
+
+    1. the response status is in ``statuses``, e.g. 429, 5xx
+    2. the connection can not be established, the request never reached the server, always safe to retry
+    3. other transport errors, e.g. connection reset, timeout, only if ``retry_transport``,
+       as the request may have been processed by the server
+    """
+    max_retries: int
+    base_delay: float
+    max_delay: float
+    max_total: float
+    statuses: frozenset
+    retry_transport: bool
+    nonce_field: Optional[str]
+
+    def __init__(self,
+                 *,
+                 max_retries: int = 3,
+                 base_delay: float = 0.5,
+                 max_delay: float = 30,
+                 max_total: float = 60,
+                 statuses: Iterable[int] = (429, 500, 502, 503, 504),
+                 retry_transport: bool = True,
+                 nonce_field: Optional[str] = None):
+        """
+        :param max_retries: max count of retries, 0 means never retry
+        :param base_delay: seconds, the backoff of the n-th retry is a random value in [0, base_delay * 2^n]
+        :param max_delay: seconds, cap of the backoff
+        :param max_total: seconds, the request gives up if the next retry would start after this since the first try
+        :param statuses: http statuses to retry on
+        :param retry_transport: retry on transport errors which may happen after the request sent
+        :param nonce_field: the json field to put a random nonce into before the first try, if the caller not set it,
+            thus all attempts carry the same nonce. khl server does not deduplicate by it, only echoes it back,
+            so it helps to detect duplicates caused by retrying, e.g. in the echoed msg event, not to prevent them
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_total = max_total
+        self.statuses = frozenset(statuses)
+        self.retry_transport = retry_transport
+        self.nonce_field = nonce_field
+
+    def prepare(self, params: Dict):
+        """adjust request params before the first try, e.g. inject the nonce"""
+        if self.nonce_field is None or not isinstance(params.get('json'), dict):
+            return
+        if not params['json'].get(self.nonce_field):
+            params['json'] = {**params['json'], self.nonce_field: uuid.uuid4().hex}
+
+    def is_retryable(self, error: BaseException) -> bool:
+        """if the error is worth a retry under this policy"""
+        status = getattr(error, 'status', None)
+        if status is not None:
+            return status in self.statuses
+        if isinstance(error, ClientConnectorError):
+            return True
+        if isinstance(error, (ClientConnectionError, asyncio.TimeoutError)):
+            return self.retry_transport
+        return False
+
+    def backoff(self, attempt: int) -> float:
+        """seconds to wait before the retry after the ``attempt``-th try failed"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def next_delay(self, error: BaseException, attempt: int, elapsed: float) -> Optional[float]:
+        """
+        :return: seconds to wait before the next try, None if should give up
+        """
+        if attempt >= self.max_retries:
+            return None
+        delay = self.backoff(attempt)
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after:
+            delay = max(delay, retry_after)
+        if elapsed + delay > self.max_total:
+            return None
+        return delay
+
+
+# rejected by the server or never sent: safe for any request
+NON_IDEMPOTENT = RetryPolicy(statuses=(429,), retry_transport=False)
+# reads can be repeated freely
+IDEMPOTENT = RetryPolicy()
+# message creating: retried only if surely not created, like NON_IDEMPOTENT, as khl server does not deduplicate by
+# nonce. the nonce is still injected, thus a duplicate, if any, can be detected by the echoed nonce
+NONCE_TAGGED = RetryPolicy(statuses=(429,), retry_transport=False, nonce_field='nonce')
+NO_RETRY = RetryPolicy(max_retries=0)
+
+TypeRetryHook = Callable[[RetryRecord], None]
+
+_LOG_LEVELS = {RetryOutcomes.RETRYING: logging.INFO, RetryOutcomes.EXHAUSTED: logging.WARNING}
+
+
+def _is_single_use(data) -> bool:
+    """if the request body is consumed by sending, thus can not be sent again, e.g. an uploaded file"""
+    return isinstance(data, (FormData, io.IOBase))
+
+
+class Retrier:
+    """
+    picks the retry policy of requests, per route, then per method:
+
+    0. ``NO_RETRY`` if the body can not be sent twice, i.e. ``FormData`` or a file object, e.g. ``asset/create``
+    1. ``routes[route]`` if set, ``NONCE_TAGGED`` for ``message/create`` and ``direct-message/create`` in default
+    2. ``get_policy`` for GET, ``IDEMPOTENT`` in default
+    3. ``default_policy`` for others, ``NON_IDEMPOTENT`` in default
+
+    every failed attempt and recovery is recorded into ``metrics`` and passed to the ``hooks``
+    """
+    routes: Dict[str, RetryPolicy]
+    get_policy: RetryPolicy
+    default_policy: RetryPolicy
+    metrics: RetryMetrics
+    hooks: List[TypeRetryHook]
+
+    def __init__(self,
+                 routes: Dict[str, RetryPolicy] = None,
+                 *,
+                 get_policy: RetryPolicy = IDEMPOTENT,
+                 default_policy: RetryPolicy = NON_IDEMPOTENT,
+                 hooks: Iterable[TypeRetryHook] = ()):
+        self.routes = {'message/create': NONCE_TAGGED, 'direct-message/create': NONCE_TAGGED}
+        self.routes.update(routes or {})
+        self.get_policy = get_policy
+        self.default_policy = default_policy
+        self.metrics = RetryMetrics()
+        self.hooks = list(hooks)
+
+    def policy_of(self, method: str, route: str, params: Optional[Dict] = None) -> RetryPolicy:
+        """the policy applied to the request, ``params`` are the kwargs of the request"""
+        if params and _is_single_use(params.get('data')):
+            return NO_RETRY
+        policy = self.routes.get(route)
+        if policy is not None:
+            return policy
+        return self.get_policy if method == 'GET' else self.default_policy
+
+    def add_hook(self, hook: TypeRetryHook):
+        """add a hook called with RetryRecord on every failed attempt and recovery"""
+        self.hooks.append(hook)
+        return hook
+
+    def emit(self, record: RetryRecord):
+        """record into metrics and call hooks"""
+        self.metrics.record(record)
+        log.log(_LOG_LEVELS.get(record.outcome, logging.DEBUG), record)
+        for hook in self.hooks:
+            try:
+                hook(record)
+            except Exception as e:
+                log.exception('error raised during retry hook', exc_info=e)
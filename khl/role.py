@@ -7,7 +7,8 @@ class Role:
 
     represent the component that used in permission control and user identify
     """
-    id: int
+    __slots__ = ('role_id', 'name', 'color', 'position', 'hoist', 'mentionable', 'permissions', 'type')
+    role_id: int
     name: str
     color: int
     position: int
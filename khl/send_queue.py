@@ -0,0 +1,176 @@
+"""send_queue: coalesce bursts of msgs sent to the same channel, to save requests"""
+import asyncio
+import logging
+from typing import Dict, Iterator, List, Optional, Union
+
+from ._types import MessageTypes
+from .channel import Channel
+
+log = logging.getLogger(__name__)
+
+_MERGEABLE = (MessageTypes.TEXT, MessageTypes.KMD, MessageTypes.CARD)
+
+
+class _Item:
+    __slots__ = ('type', 'content', 'kwargs', 'future')
+
+    def __init__(self, type: MessageTypes, content: Union[str, List], kwargs: Dict, future: asyncio.Future):
+        self.type = type
+        self.content = content
+        self.kwargs = kwargs
+        self.future = future
+
+    @property
+    def key(self):
+        """items can be merged only if with the same key"""
+        return self.type, sorted(self.kwargs.items())
+
+    @property
+    def size(self) -> int:
+        """count of cards for card msgs, length of content for others"""
+        return len(self.content)
+
+
+class SendQueue:
+    """
+    opt-in outbound queue of a channel: msgs sent within ``window`` seconds are coalesced before sending
+
+    - consecutive TEXT/KMD msgs of the same type are joined with ``separator``, up to ``max_content`` chars
+    - consecutive card msgs are merged into one, up to ``max_cards`` cards
+    - msgs with different kwargs (e.g. ``quote``, ``temp_target_id``) or of other types are sent alone
+
+    msgs are sent in the order queued, ``send()`` returns the result of the request that carried the msg,
+    thus all msgs merged into one share the same ``msg_id``
+
+    usage::
+
+        queue = SendQueue(channel)
+        await queue.send('line 1')  # from many tasks
+        await queue.close()  # flush the rest before exit
+
+    limits in default follow the khl docs, a msg already exceeds them is sent alone
+    """
+    target: Channel
+    window: float
+    max_content: int
+    max_cards: int
+    separator: str
+    _pending: List[_Item]
+    _worker: Optional[asyncio.Future]
+    _wakeup: Optional[asyncio.Event]
+
+    def __init__(self,
+                 target: Channel,
+                 *,
+                 window: float = 0.2,
+                 max_content: int = 8000,
+                 max_cards: int = 5,
+                 separator: str = '\n'):
+        """
+        :param target: where msgs sent to, a channel or a user
+        :param window: seconds to wait for more msgs after the first one queued
+        :param max_content: max chars of a merged TEXT/KMD msg
+        :param max_cards: max cards of a merged card msg
+        :param separator: put between merged TEXT/KMD msgs
+        """
+        self.target = target
+        self.window = window
+        self.max_content = max_content
+        self.max_cards = max_cards
+        self.separator = separator
+        self._pending = []
+        self._worker = None
+        self._wakeup = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def send(self, content: Union[str, List], *, type: MessageTypes = None, **kwargs) -> Dict:
+        """
+        queue a msg, the same params as ``Channel.send()``
+
+        cancelling the call before the msg flushed removes it from the queue
+
+        :return: the result of the request sending the msg, e.g. ``{'msg_id': ...}``
+        """
+        if isinstance(content, list):
+            type = MessageTypes.CARD
+        type = type if type is not None else MessageTypes.KMD
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append(_Item(type, content, kwargs, future))
+        if self._worker is None:
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.ensure_future(self._run())
+        return await future
+
+    async def flush(self):
+        """send all queued msgs now, without waiting for the window"""
+        if self._worker is None:
+            return
+        self._wakeup.set()
+        await asyncio.shield(self._worker)
+
+    async def close(self):
+        """flush, the queue can still be used after closed"""
+        await self.flush()
+
+    async def _run(self):
+        try:
+            while self._pending:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                items, self._pending = [i for i in self._pending if not i.future.done()], []
+                for batch in self._batches(items):
+                    await self._send_batch(batch)
+        finally:
+            self._worker = None
+
+    def _batches(self, items: List[_Item]) -> Iterator[List[_Item]]:
+        """split items into batches, each batch is sent as one msg"""
+        batch: List[_Item] = []
+        size = 0
+        for item in items:
+            if batch and self._fits(batch[0], item, size):
+                batch.append(item)
+                size += item.size + (len(self.separator) if item.type != MessageTypes.CARD else 0)
+                continue
+            if batch:
+                yield batch
+            batch, size = [item], item.size
+        if batch:
+            yield batch
+
+    def _fits(self, head: _Item, item: _Item, size: int) -> bool:
+        if head.type not in _MERGEABLE or head.key != item.key:
+            return False
+        if head.type == MessageTypes.CARD:
+            return size + item.size <= self.max_cards
+        return size + len(self.separator) + item.size <= self.max_content
+
+    async def _send_batch(self, batch: List[_Item]):
+        batch = [i for i in batch if not i.future.done()]  # cancelled during sending previous batches
+        if not batch:
+            return
+        head = batch[0]
+        if len(batch) == 1:
+            content = head.content
+        elif head.type == MessageTypes.CARD:
+            content = [card for item in batch for card in item.content]
+        else:
+            content = self.separator.join(item.content for item in batch)
+        try:
+            result = await self.target.send(content, type=head.type, **head.kwargs)
+        except Exception as e:  # pylint: disable = broad-except
+            log.debug(f'send_queue: failed to send a batch of {len(batch)} msgs to {self.target.id}: {e}')
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        if len(batch) > 1:
+            log.debug(f'send_queue: sent {len(batch)} msgs to {self.target.id} in one request')
+        for item in batch:
+            if not item.future.done():
+                item.future.set_result(result)
@@ -1,8 +1,8 @@
-import json
 from typing import List, Union
 
 from . import api
 from ._types import MessageTypes, FriendTypes
+from .codec import dumps
 from .gateway import Requestable, Gateway
 from .interface import LazyLoadable
 from .intimacy import Intimacy
@@ -15,6 +15,8 @@ class User(LazyLoadable, Requestable):
 
     represent a entity that interact with khl server
     """
+    __slots__ = ('id', 'username', 'nickname', 'identify_num', 'online', 'bot', 'status', 'avatar', 'vip_avatar',
+                 'mobile_verified', '_loaded', 'gate')
     id: str
     username: str
     nickname: str
@@ -59,7 +61,7 @@ class User(LazyLoadable, Requestable):
         # if content is card msg, then convert it to plain str
         if isinstance(content, List):
             type = MessageTypes.CARD
-            content = json.dumps(content)
+            content = dumps(content)
         else:
             type = type or MessageTypes.KMD
 
@@ -98,6 +100,7 @@ class GuildUser(User):
     """a user in guild
 
     with some fields more than User"""
+    __slots__ = ('guild_id', 'joined_at', 'active_time', 'roles')
     guild_id: str
     joined_at: int
     active_time: int